@@ -0,0 +1,306 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from macpm.recording import load_recording
+
+utilization_fields = ["E-Cluster_active", "P-Cluster_active", "gpu_active"]
+power_fields = ["package_W", "cpu_W", "gpu_W", "ane_W"]
+# utilization field -> frequency field
+frequency_fields = {
+    "E-Cluster_active": "E-Cluster_freq_Mhz",
+    "P-Cluster_active": "P-Cluster_freq_Mhz",
+    "gpu_active": "gpu_freq_MHz",
+}
+# (power, utilization) pairs we report the correlation of
+correlation_pairs = [
+    ("package_W", "P-Cluster_active"),
+    ("package_W", "E-Cluster_active"),
+    ("cpu_W", "P-Cluster_active"),
+    ("gpu_W", "gpu_active"),
+]
+# upper bound of wide-column values reduced at once
+max_chunk_elements = 4000000
+thermal_pressure_levels = ["Nominal", "Moderate", "Heavy", "Trapping", "Sleeping", "Unknown"]
+
+
+def load_columns(path):
+    header, data = load_recording(path)
+    index = {name: i for i, name in enumerate(header["fields"])}
+    names = [name for name in ["timestamp", "interval", "thermal_pressure", *utilization_fields,
+                               *frequency_fields.values(), *power_fields] if name in index]
+    # one pass over the file, column-major so every column below is contiguous
+    block = np.nan_to_num(np.asfortranarray(data[:, [index[name] for name in names]]), copy=False)
+    columns = {name: block[:, i] for i, name in enumerate(names)}
+    for name in ["timestamp", "interval", "thermal_pressure", *utilization_fields,
+                 *frequency_fields.values(), *power_fields]:
+        if name not in columns:
+            columns[name] = np.zeros(len(data))
+    return header, columns
+
+
+def wide_column_sums(path, dt):
+    # seconds spent in each dvfs_ state and samples flagged by each anomaly_
+    # detector. There is a dvfs_ column per core and state (hundreds to
+    # thousands), so they are reduced chunk by chunk straight from the
+    # memory map instead of being loaded like the columns above.
+    header, data = load_recording(path)
+    index = {name: i for i, name in enumerate(header["fields"])}
+    names = [name for name in header["fields"] if name.startswith(("dvfs_", "anomaly_"))]
+    seconds = np.zeros(len(names))
+    flagged = np.zeros(len(names), dtype=np.int64)
+    if not names:
+        return {}, {}
+    rows = max(max_chunk_elements // len(names), 1)
+    for start in range(0, len(data), rows):
+        block = np.nan_to_num(data[start:start + rows, [index[name] for name in names]], copy=False)
+        seconds += block.T @ dt[start:start + rows]
+        flagged += np.count_nonzero(block, axis=0)
+    return dict(zip(names, seconds.tolist())), dict(zip(names, flagged.tolist()))
+
+
+def weighted_bincount(values, width, weights, minlength=0):
+    bins = np.floor(np.clip(values, 0, None) / width).astype(np.int64)
+    return np.bincount(bins, weights=weights, minlength=minlength)
+
+
+def utilization_deciles(values):
+    return np.clip((values * 0.1).astype(np.int64), 0, 9)
+
+
+def split_phases(timestamp, interval, phase_gap, phase_length):
+    # indices where a new phase starts
+    if len(timestamp) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if phase_gap is None:
+        phase_gap = 5 * float(np.median(interval))
+    starts = np.zeros(len(timestamp), dtype=bool)
+    starts[0] = True
+    starts[1:] |= np.diff(timestamp) > phase_gap
+    if phase_length:
+        window = np.floor((timestamp - timestamp[0]) / phase_length)
+        starts[1:] |= np.diff(window) > 0
+    return np.flatnonzero(starts)
+
+
+def analyze_file(path, power_bin=1.0, freq_bin=250, phase_gap=None, phase_length=None):
+    header, columns = load_columns(path)
+    dt = columns["interval"]
+    summary = {
+        "file": path,
+        "soc": header.get("soc"),
+        "samples": len(dt),
+        "duration_s": float(dt.sum()),
+        "utilization_hist_s": {},
+        "power_hist_s": {},
+        "freq_util_hist_s": {},
+        "energy_J": {},
+        "correlation_sums": {},
+        "residency_s": {},
+        "anomalies": {},
+    }
+    for name in utilization_fields:
+        summary["utilization_hist_s"][name] = np.bincount(
+            utilization_deciles(columns[name]), weights=dt, minlength=10).tolist()
+    for name in power_fields:
+        summary["power_hist_s"][name] = weighted_bincount(columns[name], power_bin, dt).tolist()
+        summary["energy_J"][name] = float(np.dot(columns[name], dt))
+    for name, freq_name in frequency_fields.items():
+        # rows: utilization decile, columns: frequency bin
+        freq = np.floor(np.clip(columns[freq_name], 0, None) / freq_bin).astype(np.int64)
+        nfreq = int(freq.max()) + 1 if len(freq) else 1
+        cells = utilization_deciles(columns[name]) * nfreq + freq
+        summary["freq_util_hist_s"][name] = np.bincount(
+            cells, weights=dt, minlength=10 * nfreq).reshape(10, nfreq).tolist()
+
+    seconds, flagged = wide_column_sums(path, dt)
+    for name in seconds:
+        if name.startswith("dvfs_"):
+            summary["residency_s"][name[5:]] = seconds[name]
+        else:
+            summary["anomalies"][name[8:]] = flagged[name]
+
+    thermal = np.clip(columns["thermal_pressure"], 0, len(thermal_pressure_levels) - 1).astype(np.int64)
+    thermal_s = np.bincount(thermal, weights=dt, minlength=len(thermal_pressure_levels))
+    summary["thermal_pressure_s"] = dict(zip(thermal_pressure_levels, thermal_s.tolist()))
+    summary["throttle_s"] = float(thermal_s[1:].sum())
+
+    for x_name, y_name in correlation_pairs:
+        x = columns[x_name]
+        y = columns[y_name]
+        summary["correlation_sums"][x_name + "~" + y_name] = [
+            float(len(x)), float(x.sum()), float(y.sum()),
+            float(np.dot(x, x)), float(np.dot(y, y)), float(np.dot(x, y))]
+
+    starts = split_phases(columns["timestamp"], dt, phase_gap, phase_length)
+    phases = []
+    if len(starts):
+        ends = np.append(starts[1:], len(dt)) - 1
+        duration = np.add.reduceat(dt, starts)
+        energy = {name: np.add.reduceat(columns[name] * dt, starts) for name in power_fields}
+        for i in range(len(starts)):
+            phases.append({
+                "start": float(columns["timestamp"][starts[i]] - dt[starts[i]]),
+                "end": float(columns["timestamp"][ends[i]]),
+                "duration_s": float(duration[i]),
+                "energy_J": {name: float(energy[name][i]) for name in power_fields},
+            })
+    summary["phases"] = phases
+    return summary
+
+
+def add_padded(a, b):
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    shape = np.maximum(a.shape, b.shape)
+    out = np.zeros(shape)
+    out[tuple(slice(0, n) for n in a.shape)] += a
+    out[tuple(slice(0, n) for n in b.shape)] += b
+    return out
+
+
+def merge_summaries(summaries):
+    total = {
+        "file": "all",
+        "soc": None,
+        "samples": 0,
+        "duration_s": 0.0,
+        "throttle_s": 0.0,
+        "phases": [],
+    }
+    for summary in summaries:
+        total["samples"] += summary["samples"]
+        total["duration_s"] += summary["duration_s"]
+        total["throttle_s"] += summary["throttle_s"]
+        for key in ["utilization_hist_s", "power_hist_s", "freq_util_hist_s",
+                    "energy_J", "thermal_pressure_s", "correlation_sums", "residency_s", "anomalies"]:
+            merged = total.setdefault(key, {})
+            for name, value in summary[key].items():
+                if name not in merged:
+                    merged[name] = value
+                elif isinstance(value, list):
+                    merged[name] = add_padded(merged[name], value).tolist()
+                else:
+                    merged[name] = merged.get(name, 0.0) + value
+    return total
+
+
+def correlation(sums):
+    n, sx, sy, sxx, syy, sxy = sums
+    if n < 2:
+        return float('nan')
+    cov = sxy - sx * sy / n
+    var = (sxx - sx * sx / n) * (syy - sy * sy / n)
+    return cov / np.sqrt(var) if var > 0 else float('nan')
+
+
+def finish_summary(summary, power_bin, freq_bin):
+    # derived values, computed after merging
+    summary["correlation"] = {name: correlation(sums)
+                              for name, sums in summary["correlation_sums"].items()}
+    summary["mean_power_W"] = {name: energy / summary["duration_s"] if summary["duration_s"] else 0.0
+                               for name, energy in summary["energy_J"].items()}
+    mean_freq = {}
+    for name, hist in summary["freq_util_hist_s"].items():
+        hist = np.asarray(hist)
+        freqs = (np.arange(hist.shape[1]) + 0.5) * freq_bin
+        time_s = hist.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_freq[name] = np.where(time_s > 0, hist @ freqs / time_s, np.nan).tolist()
+    summary["mean_freq_by_utilization_MHz"] = mean_freq
+    summary["power_bin_W"] = power_bin
+    summary["freq_bin_MHz"] = freq_bin
+    return summary
+
+
+def format_histogram(hist, labels, width=30):
+    hist = np.asarray(hist, dtype=np.float64)
+    total = hist.sum()
+    lines = []
+    for label, value in zip(labels, hist):
+        share = value / total if total else 0
+        lines.append(f"    {label:>12} {'#' * int(round(share * width)):<{width}} {share * 100:5.1f}%")
+    return lines
+
+
+def format_summary(summary):
+    lines = [
+        f"{summary['file']}" + (f" ({summary['soc']})" if summary['soc'] else ""),
+        f"  samples: {summary['samples']}  duration: {summary['duration_s']:.0f}s"
+        f"  throttled: {summary['throttle_s']:.0f}s",
+        "  energy:",
+    ]
+    for name, energy in summary["energy_J"].items():
+        lines.append(f"    {name:>12} {energy:12.1f} J  (avg {summary['mean_power_W'][name]:.2f} W)")
+    lines.append("  utilization:")
+    deciles = [f"{i * 10}-{i * 10 + 9}%" for i in range(10)]
+    for name, hist in summary["utilization_hist_s"].items():
+        lines.append(f"   {name}")
+        lines.extend(format_histogram(hist, deciles))
+    lines.append("  power:")
+    power_bin = summary["power_bin_W"]
+    for name, hist in summary["power_hist_s"].items():
+        lines.append(f"   {name}")
+        labels = [f"{i * power_bin:g}-{(i + 1) * power_bin:g}W" for i in range(len(hist))]
+        lines.extend(format_histogram(hist, labels))
+    lines.append("  mean frequency by utilization (MHz):")
+    for name, freqs in summary["mean_freq_by_utilization_MHz"].items():
+        lines.append(f"    {name:>16} " + " ".join("    -" if np.isnan(f) else f"{f:5.0f}" for f in freqs))
+    lines.append("  correlation:")
+    for name, r in summary["correlation"].items():
+        lines.append(f"    {name:>32} {r:6.3f}")
+    residency = {}
+    for name, seconds in summary["residency_s"].items():
+        domain, freq = name.rsplit("_", 1)
+        if domain == "gpu" or domain.endswith("Cluster"):
+            residency.setdefault(domain, []).append((int(freq), seconds))
+    if residency:
+        lines.append("  frequency residency:")
+        for domain, states in residency.items():
+            total = sum(seconds for freq, seconds in states)
+            shares = [f"{freq}:{seconds / total * 100:.0f}%" for freq, seconds in states
+                      if total and seconds / total >= 0.01]
+            lines.append(f"    {domain:>12} " + " ".join(shares))
+    if any(summary["anomalies"].values()):
+        lines.append("  anomalous samples:")
+        for name, count in summary["anomalies"].items():
+            lines.append(f"    {name:>18} {count}")
+    if summary["phases"]:
+        lines.append("  phases:")
+        for phase in summary["phases"]:
+            lines.append(f"    {phase['duration_s']:8.0f}s  package {phase['energy_J']['package_W']:10.1f} J"
+                         f"  cpu {phase['energy_J']['cpu_W']:10.1f} J  gpu {phase['energy_J']['gpu_W']:10.1f} J")
+    return "\n".join(lines)
+
+
+def json_safe(value):
+    # NaN/inf (constant columns, empty buckets) become null, strict JSON has no NaN
+    if isinstance(value, dict):
+        return {key: json_safe(v) for key, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(v) for v in value]
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+def analyze_main(args):
+    options = dict(power_bin=args.power_bin, freq_bin=args.freq_bin,
+                   phase_gap=args.phase_gap, phase_length=args.phase_length)
+    jobs = min(args.jobs or os.cpu_count() or 1, len(args.files))
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(analyze_file, path, **options) for path in args.files]
+            summaries = [f.result() for f in futures]
+    else:
+        summaries = [analyze_file(path, **options) for path in args.files]
+    if len(summaries) > 1:
+        summaries.append(merge_summaries(summaries))
+    summaries = [finish_summary(s, args.power_bin, args.freq_bin) for s in summaries]
+    if args.json:
+        print(json.dumps(json_safe(summaries), indent=2, allow_nan=False))
+    else:
+        print("\n\n".join(format_summary(s) for s in summaries))
+    return 0
@@ -0,0 +1,132 @@
+import contextlib
+import os
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+
+# name -> (metric, context, direction, min_context, min_std, description)
+# Each metric gets an EWMA mean/variance per local hour and per decile of
+# its context (the utilization it is compared at). direction +1 flags values
+# above the baseline, -1 below; min_context only checks samples whose
+# context is at least that busy; min_std keeps a flat baseline from turning
+# noise into anomalies.
+detectors = {
+    "package_power": ("package_W", "P-Cluster_active", 1, 0, 0.5, "package power high for the load"),
+    "cpu_power": ("cpu_W", "P-Cluster_active", 1, 0, 0.5, "CPU power high for the load"),
+    "gpu_power": ("gpu_W", "gpu_active", 1, 0, 0.5, "GPU power high for the load"),
+    "p_freq_collapse": ("P-Cluster_freq_Mhz", "P-Cluster_active", -1, 70, 100, "P-CPU frequency collapse under load"),
+    "e_freq_collapse": ("E-Cluster_freq_Mhz", "E-Cluster_active", -1, 70, 50, "E-CPU frequency collapse under load"),
+    "gpu_freq_collapse": ("gpu_freq_MHz", "gpu_active", -1, 70, 50, "GPU frequency collapse under load"),
+}
+hours = 24
+deciles = 10
+default_state_path = os.path.join(os.path.expanduser("~"), ".macpm", "anomaly.npz")
+
+
+class AnomalyDetector():
+    # online, O(1) per detector per sample: one fancy-indexed update of the
+    # (detector, hour, decile) cells the sample falls into
+    def __init__(self, threshold=4.0, alpha=0.02, warmup=30, state_path=None, checkpoint_every=60):
+        self.names = list(detectors)
+        self.metrics = [detectors[n][0] for n in self.names]
+        self.contexts = [detectors[n][1] for n in self.names]
+        self.direction = np.array([detectors[n][2] for n in self.names], dtype=np.float64)
+        self.min_context = np.array([detectors[n][3] for n in self.names], dtype=np.float64)
+        self.min_std = np.array([detectors[n][4] for n in self.names], dtype=np.float64)
+        self.rows = np.arange(len(self.names))
+        self.threshold = threshold
+        self.alpha = alpha
+        self.warmup = warmup
+        shape = (len(self.names), hours, deciles)
+        self.mean = np.zeros(shape)
+        self.var = np.zeros(shape)
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.state_path = state_path
+        self.checkpoint_every = checkpoint_every
+        self.saved_at = time.monotonic()
+        # why the last save failed, None after a good one
+        self.error = None
+        if state_path:
+            self.load(state_path)
+
+    def update(self, sample):
+        # adds anomaly_<name> to the sample: the deviation in standard
+        # deviations when flagged, else 0; returns the flagged names
+        x = np.array([sample.get(m, np.nan) for m in self.metrics], dtype=np.float64)
+        context = np.array([sample.get(c, 0.0) for c in self.contexts], dtype=np.float64)
+        hour = time.localtime(sample.get("timestamp") or time.time()).tm_hour
+        decile = np.clip(np.nan_to_num(context) // 10, 0, deciles - 1).astype(np.int64)
+        cell = (self.rows, hour, decile)
+        mean = self.mean[cell]
+        std = np.maximum(np.sqrt(self.var[cell]), self.min_std)
+        valid = np.isfinite(x)
+        score = np.where(valid, (x - mean) / std * self.direction, 0.0)
+        flagged = (score > self.threshold) & (self.count[cell] >= self.warmup) & (context >= self.min_context)
+
+        # anomalies move the baseline only up to the threshold, so a spike
+        # does not become the new normal at once
+        limit = self.threshold * std
+        d = np.clip(np.where(valid, x - mean, 0.0), -limit, limit)
+        fresh = self.count[cell] == 0
+        self.mean[cell] = np.where(fresh, np.nan_to_num(x), mean + self.alpha * d)
+        self.var[cell] = np.where(fresh, 0.0, (1 - self.alpha) * (self.var[cell] + self.alpha * d * d))
+        self.count[cell] += valid
+
+        for i, name in enumerate(self.names):
+            sample["anomaly_" + name] = float(score[i] * self.direction[i]) if flagged[i] else 0.0
+        if self.state_path and time.monotonic() - self.saved_at >= self.checkpoint_every:
+            self.save(self.state_path)
+        return [self.names[i] for i in np.flatnonzero(flagged)]
+
+    def save(self, path):
+        # False when the state can't be written, e.g. to a ~/.macpm left
+        # root-owned by an earlier sudo run or a full disk; the monitor keeps
+        # running and shows self.error
+        self.saved_at = time.monotonic()
+        directory = os.path.dirname(os.path.abspath(path))
+        tmp_path = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".anomaly-", suffix=".npz")
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, names=np.array(self.names), mean=self.mean, var=self.var, count=self.count)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            if tmp_path is not None:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp_path)
+            self.error = f"can't save {path}: {e.strerror or e}"
+            return False
+        self.error = None
+        return True
+
+    def load(self, path):
+        # a missing, truncated or foreign state file starts fresh baselines
+        try:
+            with np.load(path) as state:
+                names = state["names"].tolist()
+                mean, var, count = state["mean"], state["var"], state["count"]
+        except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile):
+            return False
+        if not mean.shape == var.shape == count.shape == (len(names),) + self.mean.shape[1:]:
+            return False
+        # keep the baselines of detectors that still exist
+        for i, name in enumerate(names):
+            if name in self.names:
+                j = self.names.index(name)
+                self.mean[j] = mean[i]
+                self.var[j] = var[i]
+                self.count[j] = count[i]
+        return True
+
+
+def describe_anomalies(sample):
+    # header text for the anomaly_ fields of a sample
+    found = []
+    for name, (metric, context, direction, min_context, min_std, description) in detectors.items():
+        score = sample.get("anomaly_" + name)
+        if score:
+            found.append(f"{description} ({score:+.1f}σ)")
+    return ", ".join(found)
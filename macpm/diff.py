@@ -0,0 +1,155 @@
+import json
+
+import numpy as np
+
+from macpm.analyze import load_columns, json_safe
+
+# metric -> (unit, relative); relative metrics are compared in percent,
+# the others as an absolute difference
+metrics = {
+    "package_energy": ("J", True),
+    "cpu_energy": ("J", True),
+    "gpu_energy": ("J", True),
+    "package_mean": ("W", True),
+    "cpu_mean": ("W", True),
+    "gpu_mean": ("W", True),
+    "package_p95": ("W", True),
+    "cpu_p95": ("W", True),
+    "gpu_p95": ("W", True),
+    "p_cluster_util": ("%", False),
+    "throttle": ("%", False),
+}
+default_thresholds = {
+    "package_energy": 5.0,
+    "cpu_energy": 5.0,
+    "gpu_energy": 5.0,
+    "package_p95": 10.0,
+    "throttle": 5.0,
+}
+# upper bound of resampled values held in memory at once
+max_chunk_elements = 4000000
+
+
+def base_arrays(columns):
+    dt = columns["interval"]
+    arrays = {"interval": dt}
+    for name in ("package", "cpu", "gpu"):
+        arrays[name + "_W"] = columns[name + "_W"]
+        arrays[name + "_J"] = columns[name + "_W"] * dt
+    arrays["p_cluster_util"] = columns["P-Cluster_active"] * dt
+    arrays["throttle"] = (columns["thermal_pressure"] > 0) * dt
+    return arrays
+
+
+def run_statistics(arrays, idx):
+    # every statistic for each row of resampled indices
+    duration = arrays["interval"][idx].sum(axis=1)
+    stats = {}
+    for name in ("package", "cpu", "gpu"):
+        energy = arrays[name + "_J"][idx].sum(axis=1)
+        stats[name + "_energy"] = energy
+        stats[name + "_mean"] = energy / duration
+        stats[name + "_p95"] = np.percentile(arrays[name + "_W"][idx], 95, axis=1)
+    stats["p_cluster_util"] = arrays["p_cluster_util"][idx].sum(axis=1) / duration
+    stats["throttle"] = arrays["throttle"][idx].sum(axis=1) / duration * 100
+    return stats
+
+
+def bootstrap_indices(rng, n, iterations, block):
+    # moving block bootstrap, keeps short-range autocorrelation of the series
+    block = max(1, min(block, n))
+    nblocks = -(-n // block)
+    starts = rng.integers(0, n - block + 1, size=(iterations, nblocks))
+    idx = starts[:, :, None] + np.arange(block)
+    return idx.reshape(iterations, -1)[:, :n]
+
+
+def bootstrap(arrays, iterations, block, rng):
+    n = len(arrays["interval"])
+    chunk = max(1, max_chunk_elements // n)
+    results = {name: [] for name in metrics}
+    for start in range(0, iterations, chunk):
+        idx = bootstrap_indices(rng, n, min(chunk, iterations - start), block)
+        for name, values in run_statistics(arrays, idx).items():
+            results[name].append(values)
+    return {name: np.concatenate(values) for name, values in results.items()}
+
+
+def change(a, b, relative):
+    if relative:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (b / a - 1) * 100
+    return b - a
+
+
+def parse_thresholds(items):
+    thresholds = dict(default_thresholds)
+    for item in items or []:
+        name, _, value = item.partition("=")
+        if name not in metrics:
+            raise SystemExit(f"unknown metric {name!r}, choose from {', '.join(metrics)}")
+        thresholds[name] = float(value) if value else None
+    return thresholds
+
+
+def compare(path_a, path_b, iterations=2000, block=10, confidence=0.95, thresholds=None, seed=None):
+    rng = np.random.default_rng(seed)
+    arrays_a = base_arrays(load_columns(path_a)[1])
+    arrays_b = base_arrays(load_columns(path_b)[1])
+    for path, arrays in ((path_a, arrays_a), (path_b, arrays_b)):
+        if len(arrays["interval"]) < 2:
+            raise SystemExit(f"{path} has too few samples")
+    point_a = run_statistics(arrays_a, np.arange(len(arrays_a["interval"]))[None])
+    point_b = run_statistics(arrays_b, np.arange(len(arrays_b["interval"]))[None])
+    boot_a = bootstrap(arrays_a, iterations, block, rng)
+    boot_b = bootstrap(arrays_b, iterations, block, rng)
+    alpha = (1 - confidence) / 2 * 100
+    results = []
+    for name, (unit, relative) in metrics.items():
+        a = float(point_a[name][0])
+        b = float(point_b[name][0])
+        low, high = np.nanpercentile(change(boot_a[name], boot_b[name], relative), [alpha, 100 - alpha])
+        threshold = (thresholds or {}).get(name)
+        # only fail when the whole interval is above the allowed regression
+        failed = threshold is not None and bool(low > threshold)
+        results.append({
+            "metric": name,
+            "unit": unit,
+            "relative": relative,
+            "a": a,
+            "b": b,
+            "change": float(change(np.float64(a), np.float64(b), relative)),
+            "ci_low": float(low),
+            "ci_high": float(high),
+            "threshold": threshold,
+            "failed": failed,
+        })
+    return results
+
+
+def format_results(results, confidence):
+    lines = [f"{'metric':<16}{'A':>12}{'B':>12}{'change':>10}  {int(confidence * 100)}% CI{'':>12}{'limit':>8}"]
+    for r in results:
+        suffix = "%" if r["relative"] else ""
+        limit = "" if r["threshold"] is None else f"{r['threshold']:+.1f}{suffix}"
+        status = "FAIL" if r["failed"] else ("pass" if r["threshold"] is not None else "")
+        lines.append("".join([
+            f"{r['metric']:<16}",
+            f"{r['a']:>10.2f}{r['unit']:<2}",
+            f"{r['b']:>10.2f}{r['unit']:<2}",
+            f"{r['change']:>+9.1f}{suffix or ' '}",
+            f"  [{r['ci_low']:+.1f}, {r['ci_high']:+.1f}]{suffix or ' '}".ljust(20),
+            f"{limit:>8}  {status}",
+        ]))
+    return "\n".join(lines)
+
+
+def diff_main(args):
+    thresholds = parse_thresholds(args.threshold)
+    results = compare(args.a, args.b, iterations=args.iterations, block=args.block,
+                      confidence=args.confidence, thresholds=thresholds, seed=args.seed)
+    if args.json:
+        print(json.dumps(json_safe(results), indent=2, allow_nan=False))
+    else:
+        print(format_results(results, args.confidence))
+    return 1 if any(r["failed"] for r in results) else 0
@@ -0,0 +1,240 @@
+import argparse
+import math
+import plistlib
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+# stand-in for `powermetrics -f plist` so macpm can be run and load-tested
+# without a Mac: macpm --powermetrics "macpm-fake-powermetrics --topology m1-ultra"
+
+e_states_MHz = [600, 972, 1332, 1704, 2064]
+p_states_MHz = [600, 828, 1056, 1284, 1500, 1728, 1956, 2184, 2388, 2592, 2772, 2988, 3096, 3144, 3204]
+gpu_states_MHz = [389, 486, 648, 778, 972, 1296]
+bandwidth_names = ["PCPU0 DCS RD", "PCPU0 DCS WR", "PCPU1 DCS RD", "PCPU1 DCS WR",
+                   "ECPU DCS RD", "ECPU DCS WR", "GFX DCS RD", "GFX DCS WR",
+                   "ISP DCS RD", "ISP DCS WR", "VDEC DCS RD", "VDEC DCS WR",
+                   "DCS RD", "DCS WR"]
+thermal_levels = ["Nominal", "Moderate", "Heavy", "Trapping"]
+
+# name -> (hw_model, [(cluster name, cores)], clusters report down_ratio)
+topologies = {
+    "m1": ("MacBookAir10,1", [("E-Cluster", 4), ("P-Cluster", 4)], False),
+    "m1-max": ("MacBookPro18,2", [("E-Cluster", 2), ("P0-Cluster", 4), ("P1-Cluster", 4)], True),
+    "m1-ultra": ("Mac13,2", [("E0-Cluster", 2), ("E1-Cluster", 2), ("P0-Cluster", 4),
+                             ("P1-Cluster", 4), ("P2-Cluster", 4), ("P3-Cluster", 4)], True),
+}
+
+
+def parse_topology(name):
+    if name in topologies:
+        return topologies[name]
+    if name.startswith("synthetic:"):
+        # one E core per eight, E clusters of 4 and P clusters of 8 cores
+        cores = int(name.split(":", 1)[1])
+        e_cores = max(cores // 8, 1)
+        p_cores = max(cores - e_cores, 1)
+        e_clusters = math.ceil(e_cores / 4)
+        p_clusters = math.ceil(p_cores / 8)
+        # a lone cluster has no index, as on single-cluster parts
+        clusters = [("E-Cluster" if e_clusters == 1 else f"E{i}-Cluster", min(4, e_cores - i * 4))
+                    for i in range(e_clusters)]
+        clusters += [("P-Cluster" if p_clusters == 1 else f"P{i}-Cluster", min(8, p_cores - i * 8))
+                     for i in range(p_clusters)]
+        return ("Synthetic" + str(cores), clusters, True)
+    raise SystemExit(f"unknown topology {name!r}, use {', '.join(topologies)} or synthetic:CORES")
+
+
+def workload(shape, t, period, phase=0.0):
+    # load between 0 and 1 at time t
+    x = (t / period + phase) % 1.0
+    if shape == "idle":
+        load = 0.03
+    elif shape == "steady":
+        load = 0.5
+    elif shape == "ramp":
+        load = x
+    elif shape == "sine":
+        load = 0.5 + 0.5 * math.sin(2 * math.pi * x)
+    elif shape == "burst":
+        load = 1.0 if x < 0.2 else 0.05
+    else:
+        load = random.random()
+    return min(max(load + random.gauss(0, 0.03), 0.0), 1.0)
+
+
+def residency(states, freq, active, elapsed_ns):
+    # active time at the chosen state and its lower neighbour, idle at the lowest
+    index = states.index(freq)
+    used = [0.0] * len(states)
+    used[index] += active * 0.8
+    used[max(index - 1, 0)] += active * 0.2
+    used[0] += 1 - active
+    return [{"freq": f, "used_ns": int(u * elapsed_ns), "used_ratio": u} for f, u in zip(states, used)]
+
+
+def pick_state(states, load):
+    return states[min(int(load ** 0.5 * len(states)), len(states) - 1)]
+
+
+class FakePowermetrics():
+    def __init__(self, topology, shape, period, tasks, bandwidth):
+        self.hw_model, self.clusters, self.down_ratio = parse_topology(topology)
+        self.shape = shape
+        self.period = period
+        self.tasks = tasks
+        self.bandwidth = bandwidth
+        self.heat = 0.0
+        self.start = time.monotonic()
+
+    def sample(self, elapsed_ns):
+        t = time.monotonic() - self.start
+        elapsed_s = elapsed_ns / 1e9
+        clusters = []
+        cpu_power = 0.0
+        cpu = 0
+        for n, (name, cores) in enumerate(self.clusters):
+            efficiency = name[0] == 'E'
+            states = e_states_MHz if efficiency else p_states_MHz
+            core_power = 0.5 if efficiency else 4.0
+            cpus = []
+            loads = []
+            for i in range(cores):
+                load = workload(self.shape, t, self.period, phase=0.02 * cpu)
+                if efficiency:
+                    load = min(load * 0.6 + 0.1, 1.0)
+                freq = pick_state(states, load)
+                item = {
+                    "cpu": cpu,
+                    "freq_hz": freq * 1e6,
+                    "idle_ratio": 1 - load,
+                    "dvfm_states": residency(states, freq, load, elapsed_ns),
+                }
+                if self.down_ratio:
+                    item["down_ratio"] = 0.0
+                cpus.append(item)
+                loads.append(load)
+                cpu_power += core_power * load * (freq / states[-1]) ** 2
+                cpu += 1
+            cluster_load = sum(loads) / len(loads)
+            cluster_freq = pick_state(states, max(loads))
+            cluster = {
+                "name": name,
+                "freq_hz": cluster_freq * 1e6,
+                "idle_ratio": 1 - cluster_load,
+                "dvfm_states": residency(states, cluster_freq, cluster_load, elapsed_ns),
+                "cpus": cpus,
+            }
+            if self.down_ratio:
+                cluster["down_ratio"] = 0.0
+            clusters.append(cluster)
+
+        gpu_load = workload(self.shape, t, self.period, phase=0.5)
+        gpu_freq = pick_state(gpu_states_MHz, gpu_load)
+        gpu_power = 8.0 * gpu_load * (gpu_freq / gpu_states_MHz[-1]) ** 2 + 0.02
+        ane_power = 0.0
+        package_power = cpu_power + gpu_power + ane_power + 0.1
+        # crude thermal model: heat builds up above 25 W and decays below
+        self.heat = max(self.heat + (package_power - 25) * elapsed_s, 0.0)
+        pressure = thermal_levels[min(int(self.heat / 200), len(thermal_levels) - 1)]
+
+        disk_load = workload(self.shape, t, self.period, phase=0.25)
+        net_load = workload(self.shape, t, self.period, phase=0.75)
+        sample = {
+            "is_delta": True,
+            "elapsed_ns": elapsed_ns,
+            "hw_model": self.hw_model,
+            "kern_osversion": "fake",
+            "timestamp": datetime.now(timezone.utc).replace(tzinfo=None),
+            "thermal_pressure": pressure,
+            "processor": {
+                "clusters": clusters,
+                "cpu_energy": cpu_power * elapsed_s * 1000,
+                "gpu_energy": gpu_power * elapsed_s * 1000,
+                "ane_energy": ane_power * elapsed_s * 1000,
+                "combined_power": package_power * elapsed_s * 1000,
+            },
+            "gpu": {
+                "freq_hz": gpu_freq,
+                "idle_ratio": 1 - gpu_load,
+                "dvfm_states": residency(gpu_states_MHz, gpu_freq, gpu_load, elapsed_ns),
+            },
+            "disk": {
+                "rops_per_s": disk_load * 2000,
+                "wops_per_s": disk_load * 1000,
+                "rbytes_per_s": disk_load * 5e8,
+                "wbytes_per_s": disk_load * 2e8,
+            },
+            "network": {
+                "ipacket_rate": net_load * 1000,
+                "opacket_rate": net_load * 500,
+                "ibyte_rate": net_load * 1e7,
+                "obyte_rate": net_load * 2e6,
+            },
+        }
+        if self.tasks:
+            sample["tasks"] = [{
+                "pid": 100 + i,
+                "name": f"task{i}",
+                "cputime_ms_per_s": random.random() * 100,
+                "intr_wakeups_per_s": random.random() * 50,
+                "diskio_bytesread_per_s": random.random() * 1e5,
+                "packets_received_per_s": random.random() * 10,
+            } for i in range(self.tasks)]
+        if self.bandwidth:
+            sample["bandwidth_counters"] = [{"name": name, "value": random.random() * 1e9 * elapsed_s}
+                                            for name in bandwidth_names]
+        return sample
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Synthetic powermetrics -f plist stream for testing macpm')
+    parser.add_argument('--samplers', '-s', default='cpu_power,gpu_power,thermal,network,disk',
+                        help='powermetrics samplers; tasks and bandwidth add those sections')
+    parser.add_argument('--format', '-f', default='plist', help='Only plist is supported')
+    parser.add_argument('--sample-rate', '-i', type=int, default=1000, dest='interval_ms',
+                        help='Sampling interval (ms)')
+    parser.add_argument('--sample-count', '-n', type=int, default=0, dest='count',
+                        help='Stop after this many samples (0: run forever)')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='Samples per second, overrides -i')
+    parser.add_argument('--topology', default='m1',
+                        help=f"{', '.join(topologies)} or synthetic:CORES")
+    parser.add_argument('--workload', default='sine',
+                        choices=['idle', 'steady', 'ramp', 'sine', 'burst', 'random'])
+    parser.add_argument('--period', type=float, default=60,
+                        help='Period of the workload shape (seconds)')
+    parser.add_argument('--tasks', type=int, default=None,
+                        help='Number of tasks reported (default: 50 with the tasks sampler)')
+    parser.add_argument('--seed', type=int, default=None)
+    args, _ = parser.parse_known_args(argv)
+    if args.format != 'plist':
+        raise SystemExit("only -f plist is supported")
+    random.seed(args.seed)
+    samplers = args.samplers.split(",")
+    tasks = args.tasks if args.tasks is not None else (50 if "tasks" in samplers else 0)
+    interval = 1 / args.rate if args.rate else args.interval_ms / 1000
+    fake = FakePowermetrics(args.topology, args.workload, args.period, tasks, "bandwidth" in samplers)
+    out = sys.stdout.buffer
+    next_time = time.monotonic() + interval
+    last_time = time.monotonic()
+    written = 0
+    try:
+        while not args.count or written < args.count:
+            time.sleep(max(next_time - time.monotonic(), 0))
+            now = time.monotonic()
+            next_time += interval
+            sample = fake.sample(int((now - last_time) * 1e9))
+            last_time = now
+            # powermetrics separates the plist documents with a NUL byte
+            out.write((b'\x00' if written else b'') + plistlib.dumps(sample))
+            out.flush()
+            written += 1
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
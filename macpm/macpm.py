@@ -1,13 +1,25 @@
 import argparse
 import humanize
 from collections import deque
-from dashing import VSplit, HSplit, HGauge, HChart, VGauge, HBrailleChart, HBrailleFilledChart
-import os, time
+from dashing import VSplit, HSplit, HGauge, VGauge, HBrailleChart, HBrailleFilledChart, Text, Tile, TBox, vbar_elements
+import os, sys, time
+import json
+import select
+import signal
+import shlex
 import subprocess
 from subprocess import PIPE
 import psutil
 import plistlib
 import curses
+import numpy as np
+from datetime import timezone
+from macpm.recording import RecordingWriter
+from macpm.samplers import SamplerRegistry, network_sampler, disk_sampler
+from macpm.anomaly import AnomalyDetector, describe_anomalies, default_state_path as default_anomaly_state
+from macpm.parse_pool import ParsePipeline
+from macpm.stream import StreamServer, parse_address
+from macpm.shm import SharedRingReader, SharedRingWriter, default_path as default_shm_path
 
 version = 'macpm v0.24'
 parser = argparse.ArgumentParser(
@@ -20,14 +32,137 @@ parser.add_argument('--avg', type=int, default=30,
                     help='Interval for averaged values (seconds)')
 parser.add_argument('--show_cores', type=bool, default=False,
                     help='Choose show cores mode')
-
-args = parser.parse_args()
+parser.add_argument('--heatmap', action='store_true',
+                    help='Start in the per-core heatmap view')
+parser.add_argument('--residency', action='store_true',
+                    help='Show the CPU/GPU frequency residency panel')
+parser.add_argument('--layout', type=str, default=None, metavar='SPEC',
+                    help='Panels to show, e.g. "heatmap|processor,power:2,network", or a file with the layout (key 0)')
+parser.add_argument('--log_charts', action='store_true', default=False,
+                    help='Log scale for the power, disk and network charts (toggle with l)')
+parser.add_argument('--max_lag', type=float, default=None,
+                    help='Lag behind powermetrics (seconds) that switches to catch-up mode (default: 2 intervals)')
+parser.add_argument('--sampler', action='append', default=[], metavar='NAME=SECONDS',
+                    help='Cadence of a psutil sampler (ram, net, diskio), 0 disables it, repeatable')
+parser.add_argument('--powermetrics', type=str, default=None,
+                    help='Run this command instead of `sudo powermetrics`, e.g. macpm-fake-powermetrics')
+parser.add_argument('--attach', type=str, nargs='?', const=default_shm_path, default=None,
+                    help='Show the samples of a running `macpm daemon` instead of starting powermetrics')
+parser.add_argument('--anomaly', action='store_true', default=False,
+                    help='Flag power and frequency that are off their learned baseline for the load and time of day')
+parser.add_argument('--anomaly_threshold', type=float, default=4.0,
+                    help='Standard deviations from the baseline that count as an anomaly')
+parser.add_argument('--anomaly_state', type=str, default=default_anomaly_state,
+                    help='File the anomaly baselines are saved to and restored from')
+parser.add_argument('--parse_workers', type=int, default=0,
+                    help='Worker processes for parsing powermetrics output when it keeps a core busy (0: never)')
+parser.add_argument('--serve', type=str, default=None, metavar='[HOST:]PORT',
+                    help='Stream samples over HTTP (SSE on /stream, WebSocket on /ws), default host 127.0.0.1')
+parser.add_argument('--record', type=str, default=None,
+                    help='Record every sample to this file for `macpm analyze`')
+subparsers = parser.add_subparsers(dest='command')
+analyze_parser = subparsers.add_parser(
+    'analyze', help='Summarize one or more recordings made with --record')
+analyze_parser.add_argument('files', nargs='+',
+                            help='Recording files (one per host or run)')
+analyze_parser.add_argument('--jobs', '-j', type=int, default=None,
+                            help='Number of files analyzed in parallel (default: CPU count)')
+analyze_parser.add_argument('--power_bin', type=float, default=1.0,
+                            help='Width of the power histogram bins (W)')
+analyze_parser.add_argument('--freq_bin', type=int, default=250,
+                            help='Width of the frequency bins (MHz)')
+analyze_parser.add_argument('--phase_gap', type=float, default=None,
+                            help='Gap that starts a new phase (seconds, default: 5 intervals)')
+analyze_parser.add_argument('--phase_length', type=float, default=None,
+                            help='Also cut phases every PHASE_LENGTH seconds')
+analyze_parser.add_argument('--json', action='store_true',
+                            help='Print the summary as JSON')
+diff_parser = subparsers.add_parser(
+    'diff', help='Compare two recordings, exit with 1 when B regresses past a threshold')
+diff_parser.add_argument('a', help='Baseline recording')
+diff_parser.add_argument('b', help='Candidate recording')
+diff_parser.add_argument('--iterations', type=int, default=2000,
+                         help='Number of bootstrap resamples')
+diff_parser.add_argument('--block', type=int, default=10,
+                         help='Block length of the bootstrap (samples)')
+diff_parser.add_argument('--confidence', type=float, default=0.95,
+                         help='Confidence level of the intervals')
+diff_parser.add_argument('--threshold', action='append', metavar='METRIC=LIMIT',
+                         help='Allowed regression of a metric (percent, or percentage points for '
+                              'p_cluster_util and throttle), repeatable, an empty LIMIT disables it')
+diff_parser.add_argument('--seed', type=int, default=None,
+                         help='Random seed for reproducible intervals')
+diff_parser.add_argument('--json', action='store_true',
+                         help='Print the comparison as JSON')
+
+daemon_parser = subparsers.add_parser(
+    'daemon', help='Run one powermetrics and publish its samples for `macpm --attach` clients')
+daemon_parser.add_argument('--shm', type=str, default=default_shm_path,
+                           help='Path of the shared ring buffer (/tmp/macpm.shm)')
+daemon_parser.add_argument('--capacity', type=int, default=3600,
+                           help='Number of samples kept in the ring')
+
+bench_parser = subparsers.add_parser(
+    'bench', help='Measure powermetrics parse throughput inline and on worker pools')
+bench_parser.add_argument('--topology', type=str, default='m1-ultra',
+                          help='Fake powermetrics topology of the frames')
+bench_parser.add_argument('--tasks', type=int, nargs='+', default=[0, 50, 200, 800],
+                          help='Task counts per frame to compare')
+bench_parser.add_argument('--workers', type=int, nargs='+', default=[2, 4],
+                          help='Pool sizes to compare')
+bench_parser.add_argument('--frames', type=int, default=200,
+                          help='Frames parsed per measurement')
+
+soak_parser = subparsers.add_parser(
+    'soak', help='Run many samples through the display with view switches and resets, '
+                 'fail when memory or p99 frame time grows')
+soak_parser.add_argument('--samples', type=int, default=3000,
+                         help='Samples to run; a frame takes about 65 ms with tracemalloc on a slow core, '
+                              'so long runs (a million samples is most of a day) want --no_tracemalloc')
+soak_parser.add_argument('--replay', type=str, default=None,
+                         help='Cycle through the samples of a recording instead of fake powermetrics')
+soak_parser.add_argument('--topology', type=str, default='m1-ultra',
+                         help='Fake powermetrics topology')
+soak_parser.add_argument('--tasks', type=int, default=0,
+                         help='Tasks per fake powermetrics frame')
+soak_parser.add_argument('--pool', type=int, default=256,
+                         help='Distinct fake frames, parsed again on every use')
+soak_parser.add_argument('--no_parse', action='store_false', dest='parse',
+                         help='Parse the fake frames once and cycle the samples, for faster runs')
+soak_parser.add_argument('--size', type=int, nargs=2, default=[200, 50], metavar=('COLUMNS', 'LINES'),
+                         help='Terminal size rendered to')
+soak_parser.add_argument('--keys_every', type=int, default=100,
+                         help='Press the next of 2, 3, 1, l, LEFT, RIGHT, l every N samples through the '
+                              'key handler of the live display (0: never)')
+soak_parser.add_argument('--reset_every', type=int, default=1000,
+                         help='Press ctrl+r every N samples (0: never)')
+soak_parser.add_argument('--backlog_every', type=int, default=250,
+                         help='Every N samples deliver a burst of late samples, which goes through the '
+                              'catch-up merge of the live display (0: never)')
+soak_parser.add_argument('--backlog', type=int, default=5,
+                         help='Late samples per burst')
+soak_parser.add_argument('--window', type=int, default=500,
+                         help='Samples per measurement window')
+soak_parser.add_argument('--warmup', type=int, default=1000,
+                         help='Samples before the first window that growth is measured from')
+soak_parser.add_argument('--max_rss_growth', type=float, default=50,
+                         help='Allowed RSS (and traced memory) growth after warm-up (MB)')
+soak_parser.add_argument('--max_p99_growth', type=float, default=1.5,
+                         help='Allowed ratio of the last to the first p99 frame time after warm-up')
+soak_parser.add_argument('--no_tracemalloc', action='store_false', dest='tracemalloc',
+                         help='Skip tracemalloc, it slows every frame down')
+soak_parser.add_argument('--top', type=int, default=10,
+                         help='Allocation sites with the largest growth to list')
+soak_parser.add_argument('--progress', action='store_true', default=False,
+                         help='Print every window to stderr as it completes')
+
+args = None
 
 powermetrics_process = None
 
 def clear_console():
-    command = 'clear'
-    os.system(command)
+    # what `clear` prints, without starting a process
+    print("\033[H\033[2J\033[3J", end="", flush=True)
 
 
 def convert_to_GB(value):
@@ -116,6 +251,29 @@ def get_soc_info():
         "p_core_count": p_core_count,
         "gpu_core_count": get_gpu_cores()
     }
+    return set_soc_limits(soc_info)
+
+
+def get_soc_info_from_powermetrics(powermetrics_parse):
+    # used when powermetrics is not the system one, e.g. the fake on Linux
+    clusters = powermetrics_parse["processor"]["clusters"]
+    e_core_count = sum(len(c["cpus"]) for c in clusters if c["name"][0] == 'E')
+    p_core_count = sum(len(c["cpus"]) for c in clusters if c["name"][0] != 'E')
+    soc_info = {
+        "name": powermetrics_parse.get("hw_model", "Unknown"),
+        "core_count": e_core_count + p_core_count,
+        "cpu_max_power": None,
+        "gpu_max_power": None,
+        "cpu_max_bw": None,
+        "gpu_max_bw": None,
+        "e_core_count": e_core_count,
+        "p_core_count": p_core_count,
+        "gpu_core_count": "?"
+    }
+    return set_soc_limits(soc_info)
+
+
+def set_soc_limits(soc_info):
     # TDP (power)
     if soc_info["name"] == "Apple M1 Max":
         soc_info["cpu_max_power"] = 30
@@ -270,34 +428,12 @@ def parse_cpu_metrics(powermetrics_parse):
     cpu_metric_dict["P-Cluster_active"] = int((1 - p_total_idle_ratio/p_core_count)*100)
     cpu_metric_dict["e_core"] = e_core
     cpu_metric_dict["p_core"] = p_core
-    if "E-Cluster_active" not in cpu_metric_dict:
-        # M1 Ultra
-        cpu_metric_dict["E-Cluster_active"] = int(
-            (cpu_metric_dict["E0-Cluster_active"] + cpu_metric_dict["E1-Cluster_active"])/2)
-    if "E-Cluster_freq_Mhz" not in cpu_metric_dict:
-        # M1 Ultra
-        cpu_metric_dict["E-Cluster_freq_Mhz"] = max(
-            cpu_metric_dict["E0-Cluster_freq_Mhz"], cpu_metric_dict["E1-Cluster_freq_Mhz"])
-    if "P-Cluster_active" not in cpu_metric_dict:
-        if "P2-Cluster_active" in cpu_metric_dict:
-            # M1 Ultra
-            cpu_metric_dict["P-Cluster_active"] = int((cpu_metric_dict["P0-Cluster_active"] + cpu_metric_dict["P1-Cluster_active"] +
-                                                      cpu_metric_dict["P2-Cluster_active"] + cpu_metric_dict["P3-Cluster_active"]) / 4)
-        else:
-            cpu_metric_dict["P-Cluster_active"] = int(
-                (cpu_metric_dict["P0-Cluster_active"] + cpu_metric_dict["P1-Cluster_active"])/2)
-    if "P-Cluster_freq_Mhz" not in cpu_metric_dict:
-        if "P2-Cluster_freq_Mhz" in cpu_metric_dict:
-            # M1 Ultra
-            freqs = [
-                cpu_metric_dict["P0-Cluster_freq_Mhz"],
-                cpu_metric_dict["P1-Cluster_freq_Mhz"],
-                cpu_metric_dict["P2-Cluster_freq_Mhz"],
-                cpu_metric_dict["P3-Cluster_freq_Mhz"]]
-            cpu_metric_dict["P-Cluster_freq_Mhz"] = max(freqs)
-        else:
-            cpu_metric_dict["P-Cluster_freq_Mhz"] = max(
-                cpu_metric_dict["P0-Cluster_freq_Mhz"], cpu_metric_dict["P1-Cluster_freq_Mhz"])
+    for kind in "EP":
+        if kind + "-Cluster_freq_Mhz" not in cpu_metric_dict:
+            # M1 Pro/Max/Ultra and synthetic parts: E0-Cluster, P0-Cluster, P1-Cluster, ...
+            cpu_metric_dict[kind + "-Cluster_freq_Mhz"] = max(
+                cpu_metric_dict[cluster["name"] + "_freq_Mhz"] for cluster in cpu_clusters
+                if cluster["name"][0] == kind)
     # power
     cpu_metric_dict["ane_W"] = cpu_metrics["ane_energy"]/1000
     #cpu_metric_dict["dram_W"] = cpu_metrics["dram_energy"]/1000
@@ -334,8 +470,419 @@ def parse_network_metrics(powermetrics_parse):
     return network_metrics_dict
 
 
+def parse_dvfs_residency(powermetrics_parse):
+    # share of the sample spent in each DVFS state, {domain: [(MHz, ratio)]}
+    # for every cluster, every core and the GPU
+    elapsed_ns = powermetrics_parse["elapsed_ns"]
+    def states(item):
+        return [(int(state["freq"]), state["used_ns"] / elapsed_ns if "used_ns" in state else state.get("used_ratio", 0))
+                for state in item.get("dvfm_states", [])]
+    residency = {}
+    for cluster in powermetrics_parse["processor"]["clusters"]:
+        residency[cluster["name"]] = states(cluster)
+        name = 'E-Cluster' if cluster["name"][0] == 'E' else 'P-Cluster'
+        for cpu in cluster["cpus"]:
+            residency[name + str(cpu["cpu"])] = states(cpu)
+    residency["gpu"] = states(powermetrics_parse["gpu"])
+    return residency
+
+
+thermal_pressure_levels = ["Nominal", "Moderate", "Heavy", "Trapping", "Sleeping"]
+
+
+def parse_timestamp(powermetrics_parse):
+    # powermetrics reports naive UTC datetimes
+    return powermetrics_parse["timestamp"].replace(tzinfo=timezone.utc).timestamp()
+
+
+def flatten_sample(powermetrics_parse):
+    interval = powermetrics_parse["elapsed_ns"] / 1e9
+    thermal_pressure = parse_thermal_pressure(powermetrics_parse)
+    cpu_metrics_dict = parse_cpu_metrics(powermetrics_parse)
+    gpu_metrics_dict = parse_gpu_metrics(powermetrics_parse)
+    disk_metrics_dict = parse_disk_metrics(powermetrics_parse)
+    network_metrics_dict = parse_network_metrics(powermetrics_parse)
+    sample = {
+        "timestamp": parse_timestamp(powermetrics_parse),
+        "interval": interval,
+        "thermal_pressure": thermal_pressure_levels.index(thermal_pressure)
+            if thermal_pressure in thermal_pressure_levels else len(thermal_pressure_levels),
+        "gpu_active": gpu_metrics_dict["active"],
+        "gpu_freq_MHz": gpu_metrics_dict["freq_MHz"],
+    }
+    for key, value in cpu_metrics_dict.items():
+        if key in ("e_core", "p_core"):
+            continue
+        if key.endswith("_W"):
+            # energy over the sample -> average power
+            value = value / interval
+        sample[key] = value
+    for key, value in disk_metrics_dict.items():
+        sample["disk_" + key] = value
+    for key, value in network_metrics_dict.items():
+        sample["network_" + key] = value
+    for domain, states in parse_dvfs_residency(powermetrics_parse).items():
+        for freq, ratio in states:
+            sample["dvfs_" + domain + "_" + str(freq)] = ratio
+    return sample
+
+
+# 256-color ramp for 0%, 10%, ... 100% utilization
+heatmap_colors = [236, 22, 28, 34, 40, 46, 190, 226, 214, 202, 196]
+
+
+class CoreHeatmap(Tile):
+    # one row per core and one cell per sample, color is utilization and
+    # bar height is frequency. New samples are written at a sweeping cursor
+    # so a frame only repaints the columns that changed.
+    # With more cores than rows, two cores share a row (upper/lower half
+    # cell, color only).
+    def __init__(self, **kw):
+        super(CoreHeatmap, self).__init__(**kw)
+        self.labels = []
+        self.history = deque(maxlen=500)
+        self.count = 0
+        self.drawn = 0
+        self.max_freq = 1
+        self.layout = None
+
+    def append(self, labels, column):
+        # column: (active %, freq MHz) per core
+        self.labels = labels
+        self.history.append(column)
+        self.count += 1
+        for active, freq in column:
+            if freq > self.max_freq:
+                self.max_freq = freq
+
+    def invalidate(self):
+        # the screen was cleared, draw border, title and labels again
+        self.layout = None
+
+    def _color_index(self, active):
+        return min(max(int(active / 10), 0), len(heatmap_colors) - 1)
+
+    def _cell(self, column, row):
+        if self.folded:
+            top = self.fg[self._color_index(column[row * 2][0])]
+            if row * 2 + 1 < len(column):
+                return top + self.bg[self._color_index(column[row * 2 + 1][0])] + "\u2580"
+            return top + "\u2580"
+        active, freq = column[row]
+        level = min(int(freq / self.max_freq * (len(vbar_elements) - 1) + 0.5), len(vbar_elements) - 1)
+        return self.fg[self._color_index(active)] + vbar_elements[level]
+
+    def _draw_column(self, t, position, column):
+        x, y = self.inner.x, self.inner.y + self.label_width + position
+        for row in range(self.rows):
+            cell = " " if column is None else self._cell(column, row)
+            print(t.move(x + row, y) + cell + t.normal)
+
+    def _display(self, tbox, parent):
+        t = tbox.t
+        layout = (tbox.x, tbox.y, tbox.w, tbox.h, len(self.labels), self.color, self.border_color)
+        full = layout != self.layout
+        if full:
+            self.layout = layout
+            cores = len(self.labels)
+            inner_h = tbox.h - (2 if self.border_color is not None else 1)
+            self.folded = cores > inner_h
+            if self.folded:
+                labels = ["/".join(self.labels[i:i + 2]) for i in range(0, cores, 2)]
+            else:
+                labels = self.labels
+            self.rows = min(len(labels), max(inner_h, 0))
+            hidden = cores - (self.rows * 2 if self.folded else self.rows)
+            self.title = "Cores (color: usage, height: freq)" if not self.folded else "Cores (color: usage)"
+            if hidden > 0:
+                self.title += f" +{hidden} not shown"
+            self.inner = self._draw_borders_and_title(tbox)
+            self.label_width = max([len(l) for l in labels] + [0]) + 1
+            self.columns = max(self.inner.w - self.label_width, 1)
+            self.fg = [t.color(c) for c in heatmap_colors]
+            self.bg = [t.on_color(c) for c in heatmap_colors]
+            for row in range(self.rows):
+                print(t.move(self.inner.x + row, self.inner.y) + t.normal
+                      + labels[row].ljust(self.label_width) + " " * self.columns)
+            start = self.count - min(self.columns, len(self.history))
+        else:
+            start = max(self.drawn, self.count - min(self.columns, len(self.history)))
+        first = self.count - len(self.history)
+        for k in range(start, self.count):
+            self._draw_column(t, k % self.columns, self.history[k - first])
+        if self.count:
+            # blank column in front of the newest sample marks the cursor
+            self._draw_column(t, self.count % self.columns, None)
+        self.drawn = self.count
+
+
+def sample_cores(sample, cluster):
+    # core numbers of a cluster, e.g. "P-Cluster4_active" -> 4
+    cores = []
+    for key in sample:
+        if key.startswith(cluster) and key.endswith("_active") and key[len(cluster):-7].isdigit():
+            cores.append(int(key[len(cluster):-7]))
+    return sorted(cores)
+
+
+def merge_samples(samples):
+    # collapse consecutive samples into one covering their whole interval.
+    # Rates and powers are averaged by time, so energy totals stay correct.
+    # A key is averaged over the samples that have it (NaN is how the ring
+    # and recordings store a missing value), so a sampler field or core that
+    # appears halfway is not dragged towards 0.
+    interval = sum(s["interval"] for s in samples)
+    keys = dict.fromkeys(key for s in reversed(samples) for key in s)
+    merged = {}
+    for key in keys:
+        present = [s for s in samples if key in s and s[key] == s[key]]
+        if key == "interval":
+            merged[key] = interval
+        elif not present:
+            merged[key] = samples[-1].get(key, float('nan'))
+        elif key == "timestamp" or key.endswith("_timestamp"):
+            merged[key] = present[-1][key]
+        elif key == "thermal_pressure":
+            merged[key] = max(s[key] for s in present)
+        else:
+            merged[key] = sum(s[key] * s["interval"] for s in present) / sum(s["interval"] for s in present)
+    return merged
+
+
+class ResidencyHistogram():
+    # seconds spent in every DVFS state over the session and over a rolling
+    # window. Every (domain, state) pair gets a fixed slot in preallocated
+    # arrays the first time it is seen, so an update is a few vector ops.
+    def __init__(self, window):
+        self.window = max(int(window), 1)
+        self.fields = None
+
+    def _layout(self, sample):
+        self.fields = [key for key in sample if key.startswith("dvfs_")]
+        self.domains = {}
+        for i, key in enumerate(self.fields):
+            domain, freq = key[5:].rsplit("_", 1)
+            self.domains.setdefault(domain, []).append((i, int(freq)))
+        self.session = np.zeros(len(self.fields))
+        self.ring = np.zeros((self.window, len(self.fields)))
+        self.window_sum = np.zeros(len(self.fields))
+        self.count = 0
+
+    def update(self, sample):
+        if self.fields is None:
+            self._layout(sample)
+        seconds = np.fromiter((sample.get(f, 0.0) for f in self.fields),
+                              dtype=np.float64, count=len(self.fields)) * sample["interval"]
+        self.session += seconds
+        slot = self.count % self.window
+        self.window_sum += seconds - self.ring[slot]
+        self.ring[slot] = seconds
+        self.count += 1
+
+    def histogram(self, domain, rolling=False):
+        # (frequencies in MHz, seconds in each state)
+        slots = self.domains.get(domain, []) if self.fields is not None else []
+        values = self.window_sum if rolling else self.session
+        return [freq for i, freq in slots], [max(values[i], 0.0) for i, freq in slots]
+
+
+def format_residency(freqs, seconds):
+    # sparkline over the states plus the state the domain spent most time in
+    total = sum(seconds)
+    if not total:
+        return ""
+    top = max(seconds)
+    bars = "".join(vbar_elements[int(s / top * (len(vbar_elements) - 1))] for s in seconds)
+    i = seconds.index(top)
+    return f"{bars} {freqs[i]}MHz {top / total * 100:.0f}%"
+
+
+# sample fields whose raw history backs a chart
+chart_fields = ["cpu_W", "gpu_W", "disk_read_iops", "disk_write_iops", "disk_read_Bps",
+                "disk_write_Bps", "network_in_Bps", "network_out_Bps"]
+
+
+class ChartHistory():
+    # raw values of one chart in a preallocated ring
+    def __init__(self, capacity=500):
+        self.values = np.zeros(capacity)
+        self.count = 0
+
+    def append(self, value):
+        self.values[self.count % len(self.values)] = value
+        self.count += 1
+
+    def last(self, n):
+        # newest n values, oldest first
+        n = min(n, self.count, len(self.values))
+        end = self.count % len(self.values)
+        return self.values[np.arange(end - n, end) % len(self.values)]
+
+
+class HistoryChart(Tile):
+    # filled chart like dashing's HChart, drawn from a ChartHistory. Values
+    # are scaled when drawn, against `maximum` or else the largest visible
+    # value, so old points follow a new peak and log mode can be toggled.
+    def __init__(self, history, maximum=None, log=False, **kw):
+        super(HistoryChart, self).__init__(**kw)
+        self.history = history
+        self.maximum = maximum
+        self.log = log
+
+    def scaled(self, n):
+        values = self.history.last(n)
+        top = self.maximum or (values.max() if len(values) else 0)
+        if self.log:
+            values = np.log1p(np.clip(values, 0, None))
+            top = np.log1p(top)
+        if top <= 0:
+            return np.zeros(len(values))
+        return np.clip(values / top, 0, 1)
+
+    def _display(self, tbox, parent):
+        tbox = self._draw_borders_and_title(tbox)
+        print(tbox.t.color(self.color))
+        if tbox.w <= 0 or tbox.h <= 0:
+            return
+        q = (1 - self.scaled(tbox.w)) * tbox.h
+        top = q.astype(np.int64)
+        cells = np.full((tbox.h, tbox.w), " ", dtype="<U1")
+        bars = cells[:, tbox.w - len(q):]
+        rows = np.arange(tbox.h)[:, None]
+        bars[rows > top] = vbar_elements[-1]
+        edge = rows == top
+        partial = np.array(vbar_elements)[((top - q) * 8 - 1).astype(np.int64)]
+        bars[edge] = np.broadcast_to(partial, bars.shape)[edge]
+        for dx, row in enumerate(cells.tolist()):
+            print(tbox.t.move(tbox.x + dx, tbox.y) + "".join(row))
+
+
+class SizedSplit():
+    # dashing splits share their space evenly, these give each item
+    # sizes[i] / sum(sizes) of it
+    def _display(self, tbox, parent):
+        tbox = self._draw_borders_and_title(tbox)
+        vertical = isinstance(self, VSplit)
+        total = tbox.h if vertical else tbox.w
+        edges = np.round(np.cumsum([0] + self.sizes) / sum(self.sizes) * total).astype(np.int64).tolist()
+        for item, start, end in zip(self.items, edges, edges[1:]):
+            if vertical:
+                item._display(TBox(tbox.t, tbox.x + start, tbox.y, tbox.w, end - start), self)
+            else:
+                item._display(TBox(tbox.t, tbox.x, tbox.y + start, end - start, tbox.h), self)
+
+
+class SizedVSplit(SizedSplit, VSplit):
+    def __init__(self, *items, sizes, **kw):
+        super(SizedVSplit, self).__init__(*items, **kw)
+        self.sizes = list(sizes)
+
+
+class SizedHSplit(SizedSplit, HSplit):
+    def __init__(self, *items, sizes, **kw):
+        super(SizedHSplit, self).__init__(*items, **kw)
+        self.sizes = list(sizes)
+
+
+def recolor(tile, color):
+    # the whole tile tree takes the new color, bordered tiles their border too
+    tile.color = color
+    if tile.border_color is not None:
+        tile.border_color = color
+    for item in getattr(tile, "items", ()):
+        recolor(item, color)
+
+
+# panels a layout can place, each built by DefaultView.build_<name> and
+# refreshed by DefaultView.update_<name>
+layout_panels = ["processor", "heatmap", "memory", "residency", "power", "disk", "network"]
+# the views behind keys 1, 2 and 3; residency is dropped without --residency
+preset_layouts = {
+    1: "processor,memory,residency,power,disk,network",
+    2: "processor|memory,residency,power,disk,network",
+    3: "heatmap|processor,memory,residency,power,disk,network",
+}
+
+
+def parse_layout(text):
+    # "heatmap|processor,memory,power:2" -> columns split by |, panels
+    # stacked top to bottom split by , and name:size for a larger share.
+    # Returns the node tree a JSON layout file holds: a node is "name[:size]",
+    # a list of stacked nodes, or {"rows": [...]} / {"columns": [...]} with
+    # an optional "size".
+    columns = []
+    for column in text.replace(" ", "").split("|"):
+        rows = [name for name in column.split(",") if name]
+        if rows:
+            columns.append(rows[0] if len(rows) == 1 else {"rows": rows})
+    if len(columns) == 1:
+        return columns[0] if isinstance(columns[0], dict) else {"rows": columns}
+    return {"columns": columns}
+
+
+def read_layout(spec):
+    # --layout takes the text itself or a file with the text or JSON nodes
+    if os.path.isfile(spec):
+        with open(spec) as f:
+            text = f.read()
+        if text.lstrip()[:1] in ('{', '['):
+            try:
+                layout = json.loads(text)
+            except ValueError as e:
+                raise SystemExit(f"bad layout file {spec}: {e}")
+        else:
+            layout = parse_layout("".join(line.split("#")[0].strip() for line in text.splitlines()))
+    else:
+        layout = parse_layout(spec)
+    check_layout(layout, [])
+    return layout
+
+
+def check_layout(node, seen):
+    if isinstance(node, list):
+        node = {"rows": node}
+    if isinstance(node, str):
+        name, _, size = node.partition(":")
+        if name not in layout_panels:
+            raise SystemExit(f"unknown panel {name!r} in layout, choose from {', '.join(layout_panels)}")
+        if name in seen:
+            raise SystemExit(f"panel {name!r} appears twice in layout")
+        seen.append(name)
+        check_size(size or 1, f"panel {name!r}")
+        return
+    if not isinstance(node, dict) or len({"rows", "columns"} & set(node)) != 1:
+        raise SystemExit(f"bad layout node {node!r}, expected a panel name, a list, rows or columns")
+    items = node.get("rows", node.get("columns"))
+    if not isinstance(items, list) or not items:
+        raise SystemExit(f"bad layout node {node!r}, rows and columns take a non-empty list")
+    check_size(node.get("size", 1), f"node {node!r}")
+    for item in items:
+        check_layout(item, seen)
+
+
+def check_size(size, what):
+    # sizes are shares of the parent, a zero, negative or NaN total would
+    # leave the split without edges
+    try:
+        share = float(size)
+    except (TypeError, ValueError):
+        share = None
+    if share is None or not 0 < share < float("inf"):
+        raise SystemExit(f"bad size {size!r} for {what} in layout, expected a number above 0")
+
+
 class DefaultView():
     def __init__(self,soc_info_dict,args):
+        # chart history outlives construct() and reset()
+        self.histories = {name: ChartHistory() for name in chart_fields}
+        # and so do the session residency totals, fed whatever the layout shows
+        self.residency = ResidencyHistogram(args.avg / args.interval)
+        # view 0 is the --layout one, 1 to 3 the presets
+        self.custom_layout = read_layout(args.layout) if args.layout else None
+        self.view = 0 if self.custom_layout else current_view()
+        self.reset(soc_info_dict,args)
+
+    def reset(self,soc_info_dict,args):
         self.cpu_peak_power = 0
         self.gpu_peak_power = 0
         self.package_peak_power = 0
@@ -346,24 +893,96 @@ class DefaultView():
         self.network_in_bps_peak = 0
         self.network_out_bps_peak = 0
         self.default_cpu_perline = 8
+        self.e_cores = None
+        self.p_cores = None
+        self.status = ""
         self.construct(soc_info_dict,args)
-        
+
     def construct(self,soc_info_dict,args):
+        self.e_core_count = soc_info_dict["e_core_count"]
+        self.p_core_count = soc_info_dict["p_core_count"]
+        self.cpu_title = "".join([
+            soc_info_dict["name"],
+            " (cores: ",
+            str(soc_info_dict["e_core_count"]),
+            "E+",
+            str(soc_info_dict["p_core_count"]),
+            "P+",
+            str(soc_info_dict["gpu_core_count"]),
+            "GPU)"
+        ])
+        self.cpu_max_power = soc_info_dict["cpu_max_power"]
+        self.gpu_max_power = soc_info_dict["gpu_max_power"]
+        self.ane_max_power = 16.0
+        """max_cpu_bw = soc_info_dict["cpu_max_bw"]
+        max_gpu_bw = soc_info_dict["gpu_max_bw"]
+        max_media_bw = 7.0"""
+
+        self.avg_package_power_list = deque([], maxlen=int(args.avg / args.interval))
+        self.avg_cpu_power_list = deque([], maxlen=int(args.avg / args.interval))
+        self.avg_gpu_power_list = deque([], maxlen=int(args.avg / args.interval))
+
+        # only the panels in the layout are built, and only their update_
+        # methods run per frame
+        if self.view:
+            spec = preset_layouts[self.view]
+            layout = parse_layout(spec if args.residency else spec.replace("residency,", ""))
+        else:
+            layout = self.custom_layout
+        if isinstance(layout, str):
+            # the status title needs a split around a lone panel
+            layout = [layout]
+        self.color = args.color
+        self.panels = []
+        self.updaters = []
+        self.history_charts = []
+        self.history_fields = []
+        self.ui, _ = self.build_layout(layout, args)
+        """
+        ui.title = "".join([
+            version,
+            "  (Press q or ESC to stop)"
+        ])
+        ui.border_color = args.color
+        """
+        # the status goes to the processor panel, or on top of the screen without it
+        self.usage_gauges = self.processor_split if "processor" in self.panels else self.ui
+        #bw_gauges = memory_gauges.items[1]
+        self.usage_gauges.title = self.cpu_title
+
+    def build_layout(self, node, args):
+        # returns the tile for a layout node and its size
+        if isinstance(node, list):
+            node = {"rows": node}
+        if isinstance(node, str):
+            name, _, size = node.partition(":")
+            self.panels.append(name)
+            self.updaters.append(getattr(self, "update_" + name))
+            return getattr(self, "build_" + name)(args), float(size or 1)
+        vertical = "rows" in node
+        built = [self.build_layout(item, args) for item in node["rows" if vertical else "columns"]]
+        tiles = [tile for tile, size in built]
+        sizes = [size for tile, size in built]
+        if len(set(sizes)) > 1:
+            split = (SizedVSplit if vertical else SizedHSplit)(*tiles, sizes=sizes)
+        else:
+            split = (VSplit if vertical else HSplit)(*tiles)
+        return split, float(node.get("size", 1))
+
+    def build_processor(self, args):
         self.cpu1_gauge = HGauge(title="E-CPU Usage", val=0, color=args.color)
         self.cpu2_gauge = HGauge(title="P-CPU Usage", val=0, color=args.color)
         self.gpu_gauge = HGauge(title="GPU Usage", val=0, color=args.color)
         self.ane_gauge = HGauge(title="ANE", val=0, color=args.color)
         self.gpu_ane_gauges = [self.gpu_gauge, self.ane_gauge]
-        self.e_core_count = soc_info_dict["e_core_count"]
-        self.e_core_gauges = [VGauge(val=0, color=args.color, border_color=args.color) for _ in range(self.e_core_count)]
-        self.p_core_count = soc_info_dict["p_core_count"]
+        self.e_core_gauges = [VGauge(val=0, color=args.color, border_color=args.color) for _ in range(self.e_core_count if args.show_cores else 0)]
         self.max_cpu_perline = self.default_cpu_perline
         for i in range(int(self.default_cpu_perline/2),self.default_cpu_perline):
             if self.p_core_count % i == 0:
                 self.max_cpu_perline = i
                 break
         import math
-        p_core_lines = math.ceil(self.p_core_count / self.max_cpu_perline)
+        p_core_lines = math.ceil(self.p_core_count / self.max_cpu_perline) if args.show_cores else 0
         self.p_core_gauges = []
         self.p_core_split = []
         for i in range(p_core_lines):
@@ -400,7 +1019,13 @@ class DefaultView():
             title="Processor Utilization",
             border_color=args.color,
         )
+        return self.processor_split
+
+    def build_heatmap(self, args):
+        self.core_heatmap = CoreHeatmap(color=args.color, border_color=args.color)
+        return self.core_heatmap
 
+    def build_memory(self, args):
         self.ram_gauge = HGauge(title="RAM Usage", val=0, color=args.color)
         """
         ecpu_bw_gauge = HGauge(title="E-CPU B/W", val=50, color=args.color)
@@ -428,9 +1053,18 @@ class DefaultView():
             border_color=args.color,
             title="Memory"
         )
-
-        self.cpu_power_chart = HChart(title="CPU Power", color=args.color)
-        self.gpu_power_chart = HChart(title="GPU Power", color=args.color)
+        return self.memory_gauges
+
+    def build_residency(self, args):
+        self.residency_panel = Text("", color=args.color, border_color=args.color,
+                                    title=f"Frequency residency (session | last {args.avg}s)")
+        return self.residency_panel
+
+    def build_power(self, args):
+        self.cpu_power_chart = HistoryChart(self.histories["cpu_W"], title="CPU Power", color=args.color)
+        self.gpu_power_chart = HistoryChart(self.histories["gpu_W"], title="GPU Power", color=args.color)
+        self.history_charts.extend([self.cpu_power_chart, self.gpu_power_chart])
+        self.history_fields.extend(["cpu_W", "gpu_W"])
         self.power_charts = VSplit(
             self.cpu_power_chart,
             self.gpu_power_chart,
@@ -442,514 +1076,799 @@ class DefaultView():
             title="Power Chart",
             border_color=args.color,
         )
-
-        self.disk_read_iops_charts = HChart(title="read iops", color=args.color)
-        self.disk_write_iops_charts = HChart(title="write iops", color=args.color)
-        self.disk_read_bps_charts = HChart(title="read Bps", color=args.color)
-        self.disk_write_bps_charts = HChart(title="write Bps", color=args.color)
-        self.network_in_bps_charts = HChart(title="in Bps", color=args.color)
-        self.network_out_bps_charts = HChart(title="out Bps", color=args.color)
+        return self.power_charts
+
+    def build_disk(self, args):
+        self.disk_read_iops_charts = HistoryChart(self.histories["disk_read_iops"], title="read iops", color=args.color)
+        self.disk_write_iops_charts = HistoryChart(self.histories["disk_write_iops"], title="write iops", color=args.color)
+        self.disk_read_bps_charts = HistoryChart(self.histories["disk_read_Bps"], title="read Bps", color=args.color)
+        self.disk_write_bps_charts = HistoryChart(self.histories["disk_write_Bps"], title="write Bps", color=args.color)
+        self.history_charts.extend([
+            self.disk_read_iops_charts,
+            self.disk_write_iops_charts,
+            self.disk_read_bps_charts,
+            self.disk_write_bps_charts,
+        ])
+        self.history_fields.extend(["disk_read_iops", "disk_write_iops", "disk_read_Bps", "disk_write_Bps"])
         self.disk_io_charts = HSplit(
             VSplit(self.disk_read_iops_charts,
             self.disk_write_iops_charts,),
             VSplit(self.disk_read_bps_charts,
             self.disk_write_bps_charts,),
-            title="Disk IO", 
+            title="Disk IO",
             color=args.color,
             border_color=args.color)
-        
+        return self.disk_io_charts
+
+    def build_network(self, args):
+        self.network_in_bps_charts = HistoryChart(self.histories["network_in_Bps"], title="in Bps", color=args.color)
+        self.network_out_bps_charts = HistoryChart(self.histories["network_out_Bps"], title="out Bps", color=args.color)
+        self.history_charts.extend([self.network_in_bps_charts, self.network_out_bps_charts])
+        self.history_fields.extend(["network_in_Bps", "network_out_Bps"])
         self.network_io_charts = HSplit(
             self.network_in_bps_charts,
             self.network_out_bps_charts,
-            title="Network IO", 
+            title="Network IO",
             color=args.color,
             border_color=args.color)
-        
-        self.ui = HSplit(
-            self.processor_split,
-            VSplit(
-                self.memory_gauges,
-                self.power_charts,
-                self.disk_io_charts,
-                self.network_io_charts,
-            )
-        ) if args.show_cores else VSplit(
-            self.processor_split,
-            self.memory_gauges,
-            self.power_charts,
-            self.disk_io_charts,
-            self.network_io_charts,
-        )
-        """
-        ui.title = "".join([
-            version,
-            "  (Press q or ESC to stop)"
-        ])
-        ui.border_color = args.color
-        """
-        self.usage_gauges = self.ui.items[0]
-        #bw_gauges = memory_gauges.items[1]
+        return self.network_io_charts
+
+    def redraw(self):
+        # clear the screen; tiles that only repaint what changed start over
+        clear_console()
+        if "heatmap" in self.panels:
+            self.core_heatmap.invalidate()
+
+    def apply_settings(self, args):
+        # color and chart scale, as changed by keys
+        if args.color != self.color:
+            self.redraw()
+            self.color = args.color
+            recolor(self.ui, args.color)
+        for chart in self.history_charts:
+            chart.log = args.log_charts
+
+    def refresh(self, args):
+        # the last frame again with the current status, while no sample arrives
+        self.apply_settings(args)
+        self.usage_gauges.title = self.cpu_title + self.status
+        self.ui.display()
+
+    def display(self,sample,args):
+        self.apply_settings(args)
+        if self.e_cores is None:
+            self.e_cores = sample_cores(sample, "E-Cluster")
+            self.p_cores = sample_cores(sample, "P-Cluster")
+        timestamp = sample["timestamp"]
+        if timestamp :
+            self.usage_gauges.title = self.cpu_title + self.status
+            self.residency.update(sample)
+            for name in self.history_fields:
+                self.histories[name].append(sample[name])
+            for update in self.updaters:
+                update(sample, args)
+            self.ui.display()
 
-        cpu_title = "".join([
-            soc_info_dict["name"],
-            " (cores: ",
-            str(soc_info_dict["e_core_count"]),
-            "E+",
-            str(soc_info_dict["p_core_count"]),
-            "P+",
-            str(soc_info_dict["gpu_core_count"]),
-            "GPU)"
+    def update_processor(self, sample, args):
+        """e_cpu_usage = 0
+        core_count = 0
+        for i in self.e_cores:
+            e_cpu_usage += sample["E-Cluster" + str(i) + "_active"]
+            core_count += 1
+        e_cpu_usage = (e_cpu_usage / core_count) if core_count > 0 else  0"""
+        self.cpu1_gauge.title = "".join([
+            "E-CPU Usage: ",
+            str(int(sample["E-Cluster_active"])),
+            "% @ ",
+            str(int(sample["E-Cluster_freq_Mhz"])),
+            " MHz"
         ])
-        self.usage_gauges.title = cpu_title
-        self.cpu_max_power = soc_info_dict["cpu_max_power"]
-        self.gpu_max_power = soc_info_dict["gpu_max_power"]
-        self.ane_max_power = 16.0
-        """max_cpu_bw = soc_info_dict["cpu_max_bw"]
-        max_gpu_bw = soc_info_dict["gpu_max_bw"]
-        max_media_bw = 7.0"""
-
-        self.avg_package_power_list = deque([], maxlen=int(args.avg / args.interval))
-        self.avg_cpu_power_list = deque([], maxlen=int(args.avg / args.interval))
-        self.avg_gpu_power_list = deque([], maxlen=int(args.avg / args.interval))
-
-    def display(self,powermetrics_parse,args):
-        if args.color != self.gpu_gauge.color:
-            clear_console()
-            self.gpu_gauge.color = args.color
-            self.ane_gauge.color = args.color
-            self.cpu1_gauge.color = args.color
-            self.cpu2_gauge.color = args.color
-            self.power_charts.color = args.color
-            self.power_charts.border_color = args.color
-            self.processor_split.border_color = args.color
-            self.ram_gauge.color = args.color
-            self.memory_gauges.border_color = args.color
-            self.cpu_power_chart.color = args.color
-            self.gpu_power_chart.color = args.color
-            #self.cpu_power_chart.border_color = args.color
-            self.disk_io_charts.color = args.color
-            self.disk_io_charts.border_color = args.color
-            self.network_io_charts.color = args.color
-            self.network_io_charts.border_color = args.color
-            self.disk_read_iops_charts.color = args.color
-            self.disk_write_iops_charts.color = args.color
-            self.disk_read_bps_charts.color = args.color
-            self.disk_write_bps_charts.color = args.color
-            self.network_in_bps_charts.color = args.color
-            self.network_out_bps_charts.color = args.color
-            for i in range(len(self.e_core_gauges)):
-                self.e_core_gauges[i].color = args.color
-                self.e_core_gauges[i].border_color = args.color
-            for i in range(len(self.p_core_gauges)):
-                for j in range(len(self.p_core_gauges[i])):
-                    self.p_core_gauges[i][j].color = args.color
-                    self.p_core_gauges[i][j].border_color = args.color
-            """
-            for i in range(len(self.p_core_gauges_ext)):
-                self.p_core_gauges_ext[i].color = args.color
-                self.p_core_gauges_ext[i].border_color = args.color
-            """
-        thermal_pressure = parse_thermal_pressure(powermetrics_parse)
-        cpu_metrics_dict = parse_cpu_metrics(powermetrics_parse)
-        gpu_metrics_dict = parse_gpu_metrics(powermetrics_parse)
-        disk_metrics_dict = parse_disk_metrics(powermetrics_parse)
-        network_metrics_dict = parse_network_metrics(powermetrics_parse)
-        #bandwidth_metrics = parse_bandwidth_metrics(powermetrics_parse)
-        bandwidth_metrics = None
-        timestamp = powermetrics_parse["timestamp"]
-        if timestamp :
-            if thermal_pressure == "Nominal":
-                thermal_throttle = "no"
-            else:
-                thermal_throttle = "yes"
+        self.cpu1_gauge.value = sample["E-Cluster_active"]
+
+        """p_cpu_usage = 0
+        core_count = 0
+        for i in self.p_cores:
+            p_cpu_usage += sample["P-Cluster" + str(i) + "_active"]
+            core_count += 1
+        p_cpu_usage = (p_cpu_usage / core_count) if core_count > 0 else  0"""
+        self.cpu2_gauge.title = "".join([
+            "P-CPU Usage: ",
+            str(int(sample["P-Cluster_active"])),
+            "% @ ",
+            str(int(sample["P-Cluster_freq_Mhz"])),
+            " MHz"
+        ])
+        self.cpu2_gauge.value = sample["P-Cluster_active"]
 
-            """e_cpu_usage = 0
+        if args.show_cores:
             core_count = 0
-            for i in cpu_metrics_dict["e_core"]:
-                e_cpu_usage += cpu_metrics_dict["E-Cluster" + str(i) + "_active"]
+            for i in self.e_cores:
+                self.e_core_gauges[core_count % 4].title = "".join([
+                    "Core-" + str(i + 1) + " ",
+                    str(int(sample["E-Cluster" + str(i) + "_active"])),
+                    "%",
+                ])
+                self.e_core_gauges[core_count % 4].value = sample["E-Cluster" + str(i) + "_active"]
                 core_count += 1
-            e_cpu_usage = (e_cpu_usage / core_count) if core_count > 0 else  0"""
-            self.cpu1_gauge.title = "".join([
-                "E-CPU Usage: ",
-                str(cpu_metrics_dict["E-Cluster_active"]),
-                "% @ ",
-                str(cpu_metrics_dict["E-Cluster_freq_Mhz"]),
-                " MHz"
-            ])
-            self.cpu1_gauge.value = cpu_metrics_dict["E-Cluster_active"]
-
-            """p_cpu_usage = 0
             core_count = 0
-            for i in cpu_metrics_dict["p_core"]:
-                p_cpu_usage += cpu_metrics_dict["P-Cluster" + str(i) + "_active"]
+            for i in self.p_cores:
+                #core_gauges =self.p_core_gauges if core_count < 8 else self.p_core_gauges_ext
+                core_gauges = self.p_core_gauges[int(core_count / self.max_cpu_perline)]
+                core_gauges[core_count % self.max_cpu_perline].title = "".join([
+                    ("Core-" if self.p_core_count < 6 else 'C-') + str(i + 1) + " ",
+                    str(int(sample["P-Cluster" + str(i) + "_active"])),
+                    "%",
+                ])
+                core_gauges[core_count % self.max_cpu_perline].value = sample["P-Cluster" + str(i) + "_active"]
                 core_count += 1
-            p_cpu_usage = (p_cpu_usage / core_count) if core_count > 0 else  0"""
-            self.cpu2_gauge.title = "".join([
-                "P-CPU Usage: ",
-                str(cpu_metrics_dict["P-Cluster_active"]),
-                "% @ ",
-                str(cpu_metrics_dict["P-Cluster_freq_Mhz"]),
-                " MHz"
-            ])
-            self.cpu2_gauge.value = cpu_metrics_dict["P-Cluster_active"]
-
-            if args.show_cores:
-                core_count = 0
-                for i in cpu_metrics_dict["e_core"]:
-                    self.e_core_gauges[core_count % 4].title = "".join([
-                        "Core-" + str(i + 1) + " ",
-                        str(cpu_metrics_dict["E-Cluster" + str(i) + "_active"]),
-                        "%",
-                    ])
-                    self.e_core_gauges[core_count % 4].value = cpu_metrics_dict["E-Cluster" + str(i) + "_active"]
-                    core_count += 1
-                core_count = 0
-                for i in cpu_metrics_dict["p_core"]:
-                    #core_gauges =self.p_core_gauges if core_count < 8 else self.p_core_gauges_ext
-                    core_gauges = self.p_core_gauges[int(core_count / self.max_cpu_perline)]
-                    core_gauges[core_count % self.max_cpu_perline].title = "".join([
-                        ("Core-" if self.p_core_count < 6 else 'C-') + str(i + 1) + " ",
-                        str(cpu_metrics_dict["P-Cluster" + str(i) + "_active"]),
-                        "%",
-                    ])
-                    core_gauges[core_count % self.max_cpu_perline].value = cpu_metrics_dict["P-Cluster" + str(i) + "_active"]
-                    core_count += 1
-
-            self.gpu_gauge.title = "".join([
-                "GPU Usage: ",
-                str(gpu_metrics_dict["active"]),
-                "% @ ",
-                str(gpu_metrics_dict["freq_MHz"]),
-                " MHz"
-            ])
-            self.gpu_gauge.value = gpu_metrics_dict["active"]
-
-            ane_power_W = cpu_metrics_dict["ane_W"] / args.interval
-            if ane_power_W > self.ane_max_power:
-                self.ane_max_power = ane_power_W
-            ane_util_percent = int(
-                ane_power_W / self.ane_max_power * 100)
-            self.ane_gauge.title = "".join([
-                "ANE Usage: ",
-                str(ane_util_percent),
-                "% @ ",
-                '{0:.1f}'.format(ane_power_W),
-                " W"
-            ])
-            self.ane_gauge.value = ane_util_percent
 
+        self.gpu_gauge.title = "".join([
+            "GPU Usage: ",
+            str(int(sample["gpu_active"])),
+            "% @ ",
+            str(int(sample["gpu_freq_MHz"])),
+            " MHz"
+        ])
+        self.gpu_gauge.value = sample["gpu_active"]
+
+        ane_power_W = sample["ane_W"]
+        if ane_power_W > self.ane_max_power:
+            self.ane_max_power = ane_power_W
+        ane_util_percent = int(
+            ane_power_W / self.ane_max_power * 100)
+        self.ane_gauge.title = "".join([
+            "ANE Usage: ",
+            str(ane_util_percent),
+            "% @ ",
+            '{0:.1f}'.format(ane_power_W),
+            " W"
+        ])
+        self.ane_gauge.value = ane_util_percent
+
+    def update_heatmap(self, sample, args):
+        labels = []
+        column = []
+        for cluster, cores in (("E-Cluster", self.e_cores), ("P-Cluster", self.p_cores)):
+            for i in cores:
+                labels.append(cluster[0] + str(i))
+                column.append((sample[cluster + str(i) + "_active"],
+                               sample[cluster + str(i) + "_freq_Mhz"]))
+        self.core_heatmap.append(labels, column)
+
+    def update_memory(self, sample, args):
+        #bandwidth_metrics = parse_bandwidth_metrics(powermetrics_parse)
+        bandwidth_metrics = None
+        if "ram_total_GB" in sample:
+            ram_metrics_dict = {
+                "total_GB": sample["ram_total_GB"],
+                "used_GB": sample["ram_used_GB"],
+                "free_percent": sample["ram_free_percent"],
+                "swap_total_GB": sample["ram_swap_total_GB"],
+                "swap_used_GB": sample["ram_swap_used_GB"],
+            }
+        else:
+            # ram sampler disabled
             ram_metrics_dict = get_ram_metrics_dict()
 
-            if ram_metrics_dict["swap_total_GB"] < 0.1:
-                self.ram_gauge.title = "".join([
-                    "RAM Usage: ",
-                    str(ram_metrics_dict["used_GB"]),
-                    "/",
-                    str(ram_metrics_dict["total_GB"]),
-                    "GB - swap inactive"
-                ])
-            else:
-                self.ram_gauge.title = "".join([
-                    "RAM Usage: ",
-                    str(ram_metrics_dict["used_GB"]),
-                    "/",
-                    str(ram_metrics_dict["total_GB"]),
-                    "GB",
-                    " - swap:",
-                    str(ram_metrics_dict["swap_used_GB"]),
-                    "/",
-                    str(ram_metrics_dict["swap_total_GB"]),
-                    "GB"
-                ])
-            self.ram_gauge.value = ram_metrics_dict["free_percent"]
-
-            """
-
-            ecpu_bw_percent = int(
-                (bandwidth_metrics["ECPU DCS RD"] + bandwidth_metrics[
-                    "ECPU DCS WR"]) / args.interval / max_cpu_bw * 100)
-            ecpu_read_GB = bandwidth_metrics["ECPU DCS RD"] / \
-                            args.interval
-            ecpu_write_GB = bandwidth_metrics["ECPU DCS WR"] / \
-                            args.interval
-            ecpu_bw_gauge.title = "".join([
-                "E-CPU: ",
-                '{0:.1f}'.format(ecpu_read_GB + ecpu_write_GB),
-                "GB/s"
-            ])
-            ecpu_bw_gauge.value = ecpu_bw_percent
-
-            pcpu_bw_percent = int(
-                (bandwidth_metrics["PCPU DCS RD"] + bandwidth_metrics[
-                    "PCPU DCS WR"]) / args.interval / max_cpu_bw * 100)
-            pcpu_read_GB = bandwidth_metrics["PCPU DCS RD"] / \
-                            args.interval
-            pcpu_write_GB = bandwidth_metrics["PCPU DCS WR"] / \
-                            args.interval
-            pcpu_bw_gauge.title = "".join([
-                "P-CPU: ",
-                '{0:.1f}'.format(pcpu_read_GB + pcpu_write_GB),
-                "GB/s"
+        if ram_metrics_dict["swap_total_GB"] < 0.1:
+            self.ram_gauge.title = "".join([
+                "RAM Usage: ",
+                str(ram_metrics_dict["used_GB"]),
+                "/",
+                str(ram_metrics_dict["total_GB"]),
+                "GB - swap inactive"
             ])
-            pcpu_bw_gauge.value = pcpu_bw_percent
-
-            gpu_bw_percent = int(
-                (bandwidth_metrics["GFX DCS RD"] + bandwidth_metrics["GFX DCS WR"]) / max_gpu_bw * 100)
-            gpu_read_GB = bandwidth_metrics["GFX DCS RD"]
-            gpu_write_GB = bandwidth_metrics["GFX DCS WR"]
-            gpu_bw_gauge.title = "".join([
-                "GPU: ",
-                '{0:.1f}'.format(gpu_read_GB + gpu_write_GB),
-                "GB/s"
-            ])
-            gpu_bw_gauge.value = gpu_bw_percent
-
-            media_bw_percent = int(
-                bandwidth_metrics["MEDIA DCS"] / args.interval / max_media_bw * 100)
-            media_bw_gauge.title = "".join([
-                "Media: ",
-                '{0:.1f}'.format(
-                    bandwidth_metrics["MEDIA DCS"] / args.interval),
-                "GB/s"
-            ])
-            media_bw_gauge.value = media_bw_percent
-
-            total_bw_GB = (
-                                    bandwidth_metrics["DCS RD"] + bandwidth_metrics["DCS WR"]) / args.interval
-            bw_gauges.title = "".join([
-                "Memory Bandwidth: ",
-                '{0:.2f}'.format(total_bw_GB),
-                " GB/s (R:",
-                '{0:.2f}'.format(
-                    bandwidth_metrics["DCS RD"] / args.interval),
-                "/W:",
-                '{0:.2f}'.format(
-                    bandwidth_metrics["DCS WR"] / args.interval),
-                " GB/s)"
-            ])
-            if args.show_cores:
-                bw_gauges_ext = memory_gauges.items[2]
-                bw_gauges_ext.title = "Memory Bandwidth:"
-            """
-
-            package_power_W = cpu_metrics_dict["package_W"] / \
-                                args.interval
-            if package_power_W > self.package_peak_power:
-                self.package_peak_power = package_power_W
-            self.avg_package_power_list.append(package_power_W)
-            avg_package_power = get_avg(self.avg_package_power_list)
-            self.power_charts.title = "".join([
-                "CPU+GPU+ANE Power: ",
-                '{0:.2f}'.format(package_power_W),
-                "W (avg: ",
-                '{0:.2f}'.format(avg_package_power),
-                "W peak: ",
-                '{0:.2f}'.format(self.package_peak_power),
-                "W) throttle: ",
-                thermal_throttle,
+        else:
+            self.ram_gauge.title = "".join([
+                "RAM Usage: ",
+                str(ram_metrics_dict["used_GB"]),
+                "/",
+                str(ram_metrics_dict["total_GB"]),
+                "GB",
+                " - swap:",
+                str(ram_metrics_dict["swap_used_GB"]),
+                "/",
+                str(ram_metrics_dict["swap_total_GB"]),
+                "GB"
             ])
+        self.ram_gauge.value = ram_metrics_dict["free_percent"]
+        """
 
-            cpu_power_W = cpu_metrics_dict["cpu_W"] / args.interval
-            if cpu_power_W > self.cpu_peak_power:
-                self.cpu_peak_power = cpu_power_W
-            if cpu_power_W > self.cpu_max_power:
-                self.cpu_max_power = cpu_power_W
-            cpu_power_percent = int(
-                cpu_power_W / self.cpu_max_power * 100)                   
-            self.avg_cpu_power_list.append(cpu_power_W)
-            avg_cpu_power = get_avg(self.avg_cpu_power_list)
-            self.cpu_power_chart.title = "".join([
-                "CPU: ",
-                '{0:.2f}'.format(cpu_power_W),
-                "W (avg: ",
-                '{0:.2f}'.format(avg_cpu_power),
-                "W peak: ",
-                '{0:.2f}'.format(self.cpu_peak_power),
-                "W)"
-            ])
-            self.cpu_power_chart.append(cpu_power_percent)
-
-            gpu_power_W = cpu_metrics_dict["gpu_W"] / args.interval
-            if gpu_power_W > self.gpu_peak_power:
-                self.gpu_peak_power = gpu_power_W
-            if gpu_power_W > self.gpu_max_power:
-                self.gpu_max_power = gpu_power_W
-            gpu_power_percent = int(
-                gpu_power_W / self.gpu_max_power * 100)
-            self.avg_gpu_power_list.append(gpu_power_W)
-            avg_gpu_power = get_avg(self.avg_gpu_power_list)
-            self.gpu_power_chart.title = "".join([
-                "GPU: ",
-                '{0:.2f}'.format(gpu_power_W),
-                "W (avg: ",
-                '{0:.2f}'.format(avg_gpu_power),
-                "W peak: ",
-                '{0:.2f}'.format(self.gpu_peak_power),
-                "W)"
-            ])
-            self.gpu_power_chart.append(gpu_power_percent)
+        ecpu_bw_percent = int(
+            (bandwidth_metrics["ECPU DCS RD"] + bandwidth_metrics[
+                "ECPU DCS WR"]) / args.interval / max_cpu_bw * 100)
+        ecpu_read_GB = bandwidth_metrics["ECPU DCS RD"] / \
+                        args.interval
+        ecpu_write_GB = bandwidth_metrics["ECPU DCS WR"] / \
+                        args.interval
+        ecpu_bw_gauge.title = "".join([
+            "E-CPU: ",
+            '{0:.1f}'.format(ecpu_read_GB + ecpu_write_GB),
+            "GB/s"
+        ])
+        ecpu_bw_gauge.value = ecpu_bw_percent
+
+        pcpu_bw_percent = int(
+            (bandwidth_metrics["PCPU DCS RD"] + bandwidth_metrics[
+                "PCPU DCS WR"]) / args.interval / max_cpu_bw * 100)
+        pcpu_read_GB = bandwidth_metrics["PCPU DCS RD"] / \
+                        args.interval
+        pcpu_write_GB = bandwidth_metrics["PCPU DCS WR"] / \
+                        args.interval
+        pcpu_bw_gauge.title = "".join([
+            "P-CPU: ",
+            '{0:.1f}'.format(pcpu_read_GB + pcpu_write_GB),
+            "GB/s"
+        ])
+        pcpu_bw_gauge.value = pcpu_bw_percent
+
+        gpu_bw_percent = int(
+            (bandwidth_metrics["GFX DCS RD"] + bandwidth_metrics["GFX DCS WR"]) / max_gpu_bw * 100)
+        gpu_read_GB = bandwidth_metrics["GFX DCS RD"]
+        gpu_write_GB = bandwidth_metrics["GFX DCS WR"]
+        gpu_bw_gauge.title = "".join([
+            "GPU: ",
+            '{0:.1f}'.format(gpu_read_GB + gpu_write_GB),
+            "GB/s"
+        ])
+        gpu_bw_gauge.value = gpu_bw_percent
+
+        media_bw_percent = int(
+            bandwidth_metrics["MEDIA DCS"] / args.interval / max_media_bw * 100)
+        media_bw_gauge.title = "".join([
+            "Media: ",
+            '{0:.1f}'.format(
+                bandwidth_metrics["MEDIA DCS"] / args.interval),
+            "GB/s"
+        ])
+        media_bw_gauge.value = media_bw_percent
+
+        total_bw_GB = (
+                                bandwidth_metrics["DCS RD"] + bandwidth_metrics["DCS WR"]) / args.interval
+        bw_gauges.title = "".join([
+            "Memory Bandwidth: ",
+            '{0:.2f}'.format(total_bw_GB),
+            " GB/s (R:",
+            '{0:.2f}'.format(
+                bandwidth_metrics["DCS RD"] / args.interval),
+            "/W:",
+            '{0:.2f}'.format(
+                bandwidth_metrics["DCS WR"] / args.interval),
+            " GB/s)"
+        ])
+        if args.show_cores:
+            bw_gauges_ext = memory_gauges.items[2]
+            bw_gauges_ext.title = "Memory Bandwidth:"
+        """
 
-            def format_number(number):
-                return humanize.naturalsize(number)
+    def update_residency(self, sample, args):
+        lines = []
+        for domain in self.residency.domains:
+            if domain != "gpu" and not domain.endswith("Cluster"):
+                # per-core histograms are recorded but too many to show
+                continue
+            session = format_residency(*self.residency.histogram(domain))
+            rolling = format_residency(*self.residency.histogram(domain, rolling=True))
+            lines.append(f"{domain.upper() if domain == 'gpu' else domain:<11}{session}  |  {rolling}")
+        self.residency_panel.text = "\n".join(lines) or "no DVFS states reported"
+
+    def update_power(self, sample, args):
+        if sample["thermal_pressure"] == 0:
+            thermal_throttle = "no"
+        else:
+            thermal_throttle = "yes"
+
+        package_power_W = sample["package_W"]
+        if package_power_W > self.package_peak_power:
+            self.package_peak_power = package_power_W
+        self.avg_package_power_list.append(package_power_W)
+        avg_package_power = get_avg(self.avg_package_power_list)
+        self.power_charts.title = "".join([
+            "CPU+GPU+ANE Power: ",
+            '{0:.2f}'.format(package_power_W),
+            "W (avg: ",
+            '{0:.2f}'.format(avg_package_power),
+            "W peak: ",
+            '{0:.2f}'.format(self.package_peak_power),
+            "W) throttle: ",
+            thermal_throttle,
+        ])
 
-            disk_read_iops = disk_metrics_dict["read_iops"]
-            if disk_read_iops > self.disk_read_iops_peak:
-                self.disk_read_iops_peak = disk_read_iops
-            self.disk_read_iops_charts.title = "Read iops: "+ f'{disk_read_iops}'
-            if self.disk_read_iops_charts.datapoints:
-                disk_read_iops_rate = int(disk_read_iops / self.disk_read_iops_peak * 100) if self.disk_read_iops_peak > 0 else 0
-            else:
-                disk_read_iops_rate = 100
-            self.disk_read_iops_charts.append(disk_read_iops_rate)
-
-            disk_write_iops = disk_metrics_dict["write_iops"]
-            if disk_write_iops > self.disk_write_iops_peak:
-                self.disk_write_iops_peak = disk_write_iops
-            self.disk_write_iops_charts.title = "Write iops: "+ f'{disk_write_iops}'
-            if self.disk_write_iops_charts.datapoints:
-                disk_write_iops_rate = int(disk_read_iops / self.disk_write_iops_peak * 100) if self.disk_write_iops_peak > 0 else 0
-            else:
-                disk_write_iops_rate = 100
-            self.disk_write_iops_charts.append(disk_write_iops_rate)
-
-            disk_read_bps = disk_metrics_dict["read_Bps"]
-            if disk_read_bps > self.disk_read_bps_peak:
-                self.disk_read_bps_peak = disk_read_bps
-            self.disk_read_bps_charts.title = "Read : "+ f'{format_number(disk_read_bps)}/s'
-            if self.disk_read_bps_charts.datapoints:
-                disk_read_bps_rate = int(disk_read_bps / self.disk_read_bps_peak * 100) if self.disk_read_bps_peak > 0 else 0
-            else:
-                disk_read_bps_rate = 100
-            self.disk_read_bps_charts.append(disk_read_bps_rate)
-
-            disk_write_bps = disk_metrics_dict["write_Bps"]
-            if disk_write_bps > self.disk_write_bps_peak:
-                self.disk_write_bps_peak = disk_write_bps
-            self.disk_write_bps_charts.title = "Write : "+ f'{format_number(disk_write_bps)}/s'
-            if self.disk_write_bps_charts.datapoints:
-                disk_write_bps_rate = int(disk_write_bps / self.disk_write_bps_peak * 100) if self.disk_write_bps_peak > 0 else 0
-            else:
-                disk_write_bps_rate = 100
-            self.disk_write_bps_charts.append(disk_write_bps_rate)
-
-            network_in_bps = network_metrics_dict["in_Bps"]
-            if network_in_bps > self.network_in_bps_peak:
-                self.network_in_bps_peak = network_in_bps
-            self.network_in_bps_charts.title = "in : "+ f'{format_number(network_in_bps)}/s'
-            if self.network_in_bps_charts.datapoints:
-                network_in_bps_rate = int(network_in_bps / self.network_in_bps_peak * 100) if self.network_in_bps_peak > 0 else 0
-            else:
-                network_in_bps_rate = 100
-            self.network_in_bps_charts.append(network_in_bps_rate)
-
-            network_out_bps = network_metrics_dict["out_Bps"]
-            if network_out_bps > self.network_out_bps_peak:
-                self.network_out_bps_peak = network_out_bps
-            self.network_out_bps_charts.title = "out : "+ f'{format_number(network_out_bps)}/s'
-            if self.network_out_bps_charts.datapoints:
-                network_out_bps_rate = int(network_out_bps / self.network_out_bps_peak * 100)  if self.network_out_bps_peak > 0 else 0
-            else:
-                network_out_bps_rate = 100
-            self.network_out_bps_charts.append(network_out_bps_rate)
+        cpu_power_W = sample["cpu_W"]
+        if cpu_power_W > self.cpu_peak_power:
+            self.cpu_peak_power = cpu_power_W
+        if cpu_power_W > self.cpu_max_power:
+            self.cpu_max_power = cpu_power_W
+        self.cpu_power_chart.maximum = self.cpu_max_power
+        self.avg_cpu_power_list.append(cpu_power_W)
+        avg_cpu_power = get_avg(self.avg_cpu_power_list)
+        self.cpu_power_chart.title = "".join([
+            "CPU: ",
+            '{0:.2f}'.format(cpu_power_W),
+            "W (avg: ",
+            '{0:.2f}'.format(avg_cpu_power),
+            "W peak: ",
+            '{0:.2f}'.format(self.cpu_peak_power),
+            "W)"
+        ])
 
-            self.disk_io_charts.title = ''.join([f"Disk IO  (peak R:{self.disk_read_iops_peak} W:{self.disk_write_iops_peak}",
-                f" | R:{format_number(self.disk_read_bps_peak)}/s W:{format_number(self.disk_write_bps_peak)}/s)"
-            ])
-            self.network_io_charts.title = f"Network IO  (peak in:{format_number(self.network_in_bps_peak)}/s out:{format_number(self.network_out_bps_peak)}/s)"
-            self.ui.display()
+        gpu_power_W = sample["gpu_W"]
+        if gpu_power_W > self.gpu_peak_power:
+            self.gpu_peak_power = gpu_power_W
+        if gpu_power_W > self.gpu_max_power:
+            self.gpu_max_power = gpu_power_W
+        self.gpu_power_chart.maximum = self.gpu_max_power
+        self.avg_gpu_power_list.append(gpu_power_W)
+        avg_gpu_power = get_avg(self.avg_gpu_power_list)
+        self.gpu_power_chart.title = "".join([
+            "GPU: ",
+            '{0:.2f}'.format(gpu_power_W),
+            "W (avg: ",
+            '{0:.2f}'.format(avg_gpu_power),
+            "W peak: ",
+            '{0:.2f}'.format(self.gpu_peak_power),
+            "W)"
+        ])
+
+    def update_disk(self, sample, args):
+        disk_read_iops = int(sample["disk_read_iops"])
+        if disk_read_iops > self.disk_read_iops_peak:
+            self.disk_read_iops_peak = disk_read_iops
+        self.disk_read_iops_charts.title = "Read iops: "+ f'{disk_read_iops}'
+
+        disk_write_iops = int(sample["disk_write_iops"])
+        if disk_write_iops > self.disk_write_iops_peak:
+            self.disk_write_iops_peak = disk_write_iops
+        self.disk_write_iops_charts.title = "Write iops: "+ f'{disk_write_iops}'
+
+        disk_read_bps = int(sample["disk_read_Bps"])
+        if disk_read_bps > self.disk_read_bps_peak:
+            self.disk_read_bps_peak = disk_read_bps
+        self.disk_read_bps_charts.title = "Read : "+ f'{format_number(disk_read_bps)}/s'
+
+        disk_write_bps = int(sample["disk_write_Bps"])
+        if disk_write_bps > self.disk_write_bps_peak:
+            self.disk_write_bps_peak = disk_write_bps
+        self.disk_write_bps_charts.title = "Write : "+ f'{format_number(disk_write_bps)}/s'
+
+        self.disk_io_charts.title = ''.join([f"Disk IO  (peak R:{self.disk_read_iops_peak} W:{self.disk_write_iops_peak}",
+            f" | R:{format_number(self.disk_read_bps_peak)}/s W:{format_number(self.disk_write_bps_peak)}/s)"
+        ])
+
+    def update_network(self, sample, args):
+        network_in_bps = int(sample["network_in_Bps"])
+        if network_in_bps > self.network_in_bps_peak:
+            self.network_in_bps_peak = network_in_bps
+        self.network_in_bps_charts.title = "in : "+ f'{format_number(network_in_bps)}/s'
+
+        network_out_bps = int(sample["network_out_Bps"])
+        if network_out_bps > self.network_out_bps_peak:
+            self.network_out_bps_peak = network_out_bps
+        self.network_out_bps_charts.title = "out : "+ f'{format_number(network_out_bps)}/s'
+
+        self.network_io_charts.title = f"Network IO  (peak in:{format_number(self.network_in_bps_peak)}/s out:{format_number(self.network_out_bps_peak)}/s)"
+
+def format_number(number):
+    return humanize.naturalsize(number)
 
 def get_avg(inlist):
     avg = sum(inlist) / len(inlist)
     return avg
 
+# name -> default cadence (seconds) of the samplers that run next to powermetrics
+default_sampler_intervals = {
+    "ram": 1.0,
+    "net": 1.0,
+    "diskio": 2.0,
+}
+
+
+def create_samplers():
+    intervals = dict(default_sampler_intervals)
+    for item in args.sampler:
+        name, _, seconds = item.partition("=")
+        if name not in intervals:
+            raise SystemExit(f"unknown sampler {name!r}, choose from {', '.join(intervals)}")
+        intervals[name] = float(seconds or 0)
+    registry = SamplerRegistry()
+    registry.register("ram", get_ram_metrics_dict, intervals["ram"])
+    registry.register("net", network_sampler(), intervals["net"])
+    registry.register("diskio", disk_sampler(), intervals["diskio"])
+    return registry
+
+
+def powermetrics_command(restart=False):
+    options = " ".join([
+        "--samplers cpu_power,gpu_power,thermal,network,disk",
+        "-f plist",
+        "-i",
+        str(args.interval * 1000)
+    ]).split(" ")
+    if args.powermetrics:
+        return shlex.split(args.powermetrics) + options
+    # restarts happen inside the UI, where sudo must not prompt
+    return " ".join([
+        "sudo -n nice -n" if restart else "sudo nice -n",
+        str(10),
+        "powermetrics",
+    ]).split(" ") + options
+
+
+def start_powermetrics(restart=False):
+    global powermetrics_process
+    powermetrics_process = subprocess.Popen(powermetrics_command(restart), stdin=PIPE, stdout=PIPE)
+    return powermetrics_process
+
+
+class PowermetricsSupervisor():
+    # restarts powermetrics with a growing backoff when it exits, and gives
+    # up after max_failures restarts in a row without a sample: `sudo -n`
+    # fails every time once the sudo credentials have expired
+    def __init__(self, max_failures=5):
+        self.restarts = 0
+        self.restart_at = None
+        self.backoff = 1
+        self.failures = 0
+        self.max_failures = max_failures
+
+    def received(self):
+        self.backoff = 1
+        self.failures = 0
+
+    def failed(self):
+        return self.failures >= self.max_failures and powermetrics_process.poll() is not None
+
+    def status(self):
+        # title text while powermetrics is down
+        if powermetrics_process.poll() is None:
+            return ""
+        if self.restart_at is None:
+            return "powermetrics down"
+        return f"powermetrics down, retry in {max(self.restart_at - time.time(), 0):.0f}s"
+
+    def check(self):
+        # call while no samples arrive, returns True when a new process was started
+        if powermetrics_process.poll() is None:
+            return False
+        if self.restart_at is None:
+            self.restart_at = time.time() + self.backoff
+            self.backoff = min(self.backoff * 2, 30)
+        elif time.time() >= self.restart_at:
+            start_powermetrics(restart=True)
+            self.restarts += 1
+            self.failures += 1
+            self.restart_at = None
+            return True
+        time.sleep(0.1)
+        return False
+
+
+def read_frames(process, data, timeout=0.1):
+    # read everything powermetrics has written so far and split it into
+    # complete plist documents; the unfinished tail is returned as data
+    fd = process.stdout.fileno()
+    while select.select([fd], [], [], timeout)[0]:
+        chunk = os.read(fd, 1 << 16)
+        if not chunk:
+            break
+        data += chunk
+        timeout = 0
+    frames = []
+    end = data.find(b'</plist>')
+    while end >= 0:
+        end += len(b'</plist>')
+        frames.append(data[:end].replace(b'\x00', b'').lstrip())
+        data = data[end:]
+        end = data.find(b'</plist>')
+    return frames, data
+
+
+def current_view():
+    return 3 if args.heatmap else 2 if args.show_cores else 1
+
+
+def handle_key(key, view1, soc_info_dict):
+    # returns False when the key asks to quit
+    if key == 27 or chr(key).lower() == 'q':
+        print("\nStopping...")
+        return False
+    if view1 is None:
+        # nothing on screen yet
+        return True
+    if key == curses.KEY_LEFT:
+        args.color = (args.color - 1) if args.color > 1 else 8
+    elif key == curses.KEY_RIGHT:
+        args.color = (args.color + 1) if args.color < 8 else 1
+    elif chr(key).lower() == 'l':
+        args.log_charts = not args.log_charts
+    elif chr(key) in '0123':
+        view = int(chr(key))
+        # 0 is the --layout view, if there is one
+        if view != view1.view and (view or view1.custom_layout):
+            args.show_cores = view == 2
+            args.heatmap = view == 3
+            view1.view = view
+            view1.construct(soc_info_dict,args)
+        view1.redraw()
+    elif key == 0x12:
+        #press ctrl+r to reset max and peak values
+        view1.reset(soc_info_dict,args)
+    return True
+
+
+def catch_up_lag():
+    return args.max_lag if args.max_lag is not None else max(2 * args.interval, 2)
+
+
+def take_sample(samples, max_lag):
+    # the next sample to show and how many samples it stands for; takes them
+    # off the samples list
+    if len(samples) > 1 and time.time() - samples[0]["timestamp"] > max_lag:
+        # catch-up: render only the latest state of everything that piled up
+        merged = len(samples)
+        sample = merge_samples(samples)
+        del samples[:]
+        return sample, merged
+    return samples.pop(0), 1
+
+
+def frame_status(sample, merged, restarts):
+    lag = time.time() - sample["timestamp"]
+    status = []
+    if lag >= 1:
+        status.append(f"lag {lag:.1f}s")
+    if merged > 1:
+        status.append(f"catching up, merged {merged} samples")
+    if restarts:
+        status.append(f"powermetrics restarted {restarts}x")
+    anomalies = describe_anomalies(sample)
+    if anomalies:
+        status.append("anomaly: " + anomalies)
+    return "".join(" | " + s for s in status)
+
+
+def idle_status(timestamp, max_lag, down):
+    # title while no samples arrive, so a stale frame says so; None while
+    # the next sample is just not due yet
+    idle = time.time() - timestamp
+    if idle <= max_lag and not down:
+        return None
+    return f" | no sample for {idle:.0f}s" + (" | " + down if down else "")
+
+
 def begin(stdscr):
     curses.use_default_colors()
-    soc_info_dict = get_soc_info()
+    soc_info_dict = None if args.powermetrics or args.attach else get_soc_info()
     view1 = None
     stdscr.nodelay(True)
-    view = 1
+    recorder = None
+    stream = start_stream_server()
+    pipeline = ParsePipeline(args.parse_workers)
+    # in attach mode the daemon's anomaly_ fields are shown as they are
+    detector = create_anomaly_detector() if not args.attach else None
+    max_lag = catch_up_lag()
+    supervisor = PowermetricsSupervisor()
+    if args.attach:
+        # samples come from `macpm daemon`, which already merged its samplers
+        ring = SharedRingReader(args.attach)
+        soc_info_dict = set_soc_limits(ring.meta["soc"])
+        samplers = SamplerRegistry()
+    else:
+        samplers = create_samplers()
+    samplers.start()
+    error = None
     try:
         data = b''
+        samples = []
         while True:
-            output = powermetrics_process.stdout.readline()
-            if powermetrics_process.poll() is not None:
-                break
-            data = data + output
-            str_output = output.decode()
-            if str_output.startswith('</plist>'):
-                if view1 is None:
-                    view1 = DefaultView(soc_info_dict=soc_info_dict,args=args)
-                    clear_console()
-                data = data.replace(b'\x00',b'')
-                powermetrics_parse = plistlib.loads(data)
-                key = stdscr.getch()
-                if key > 0:
-                    if key == 27:
-                        print("\nStopping...")
+            down = ""
+            if args.attach:
+                samples.extend(dict(zip(ring.fields, row)) for row in ring.read().tolist())
+                if not samples:
+                    time.sleep(0.05)
+            else:
+                frames, data = read_frames(powermetrics_process, data, timeout=0.01 if pipeline.pending else 0.1)
+                if frames and soc_info_dict is None:
+                    soc_info_dict = get_soc_info_from_powermetrics(plistlib.loads(frames[0]))
+                samples.extend(pipeline.feed(frames))
+                if samples:
+                    supervisor.received()
+                elif not pipeline.pending:
+                    if view1 is None and powermetrics_process.poll() is not None:
+                        # powermetrics never produced a reading, nothing to supervise
                         break
-                    elif key  == curses.KEY_LEFT:
-                        args.color = (args.color - 1) if args.color > 1 else 8
-                    elif key == curses.KEY_RIGHT:
-                        args.color = (args.color + 1) if args.color < 8 else 1 
-                    elif chr(key).lower() == 'q':
-                        print("\nStopping...")
+                    if supervisor.check():
+                        data = b''
+                    if supervisor.failed():
+                        error = (f"powermetrics failed to restart {supervisor.failures} times in a row, "
+                                 "sudo credentials may have expired; run `sudo -v` and start macpm again")
                         break
-                    elif chr(key) == '1':
-                        args.show_cores = False
-                        if view != 1: 
-                            view1.construct(soc_info_dict,args)
-                        view = 1
-                        clear_console()
-                    elif chr(key) == '2':
-                        args.show_cores = True
-                        if view != 2: 
-                            view1.construct(soc_info_dict,args)
-                        view = 2
-                        clear_console()
-                    elif key == 0x12:
-                        #press ctrl+r to reset max and peak values
-                        view1.__init__(soc_info_dict,args)
-                           
-                if view == 1 or view == 2:
-                    view1.display(powermetrics_parse,args)
-                data = b''
-            if str_output == '':
-                time.sleep(0.1)
+                    down = supervisor.status()
+            if not samples:
+                # keys still work and the title tells how old the frame is
+                key = stdscr.getch()
+                if key > 0 and not handle_key(key, view1, soc_info_dict):
+                    break
+                if view1 is not None:
+                    status = idle_status(last_timestamp, max_lag, down)
+                    if key > 0 or (status is not None and status != view1.status):
+                        view1.status = view1.status if status is None else status
+                        view1.refresh(args)
+                continue
+            if view1 is None:
+                view1 = DefaultView(soc_info_dict=soc_info_dict,args=args)
+                view1.redraw()
+            sample, merged = take_sample(samples, max_lag)
+            last_timestamp = sample["timestamp"]
+            samplers.merge(sample)
+            if detector is not None:
+                detector.update(sample)
+            if args.record:
+                if recorder is None:
+                    recorder = RecordingWriter(args.record, sample.keys(), {
+                        "version": version,
+                        "soc": soc_info_dict["name"],
+                        "interval": args.interval,
+                    })
+                recorder.write(sample)
+            if stream is not None:
+                stream.publish(sample)
+            key = stdscr.getch()
+            if key > 0 and not handle_key(key, view1, soc_info_dict):
+                break
+
+            view1.status = frame_status(sample, merged, supervisor.restarts)
+            if detector is not None and detector.error:
+                view1.status += " | anomaly " + detector.error
+            view1.display(sample,args)
 
     except KeyboardInterrupt:
         print("Stopping...")
+    finally:
+        samplers.stop()
+        if recorder is not None:
+            recorder.close()
+        if stream is not None:
+            stream.stop()
+        pipeline.close()
+        if detector is not None and not detector.save(args.anomaly_state) and error is None:
+            error = "anomaly " + detector.error
+
+    return error
+
+def start_stream_server():
+    if not args.serve:
+        return None
+    host, port = parse_address(args.serve)
+    return StreamServer(host, port).start()
+
+
+def create_anomaly_detector():
+    if not args.anomaly:
+        return None
+    return AnomalyDetector(threshold=args.anomaly_threshold, state_path=args.anomaly_state)
+
+
+def run_daemon():
+    # one privileged powermetrics publishing to a shared ring for every client
+    soc_info_dict = None if args.powermetrics else get_soc_info()
+    supervisor = PowermetricsSupervisor()
+    samplers = create_samplers()
+    samplers.start()
+    ring = None
+    stream = start_stream_server()
+    pipeline = ParsePipeline(args.parse_workers)
+    detector = create_anomaly_detector()
+    save_error = None
+    data = b''
+    # leave through the finally below so clients see the ring go away
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Publishing samples to {args.shm}")
+    try:
+        while True:
+            frames, data = read_frames(powermetrics_process, data, timeout=0.01 if pipeline.pending else 1)
+            if frames and soc_info_dict is None:
+                soc_info_dict = get_soc_info_from_powermetrics(plistlib.loads(frames[0]))
+            for sample in pipeline.feed(frames):
+                samplers.merge(sample)
+                if detector is not None:
+                    detector.update(sample)
+                    if detector.error != save_error:
+                        save_error = detector.error
+                        print("anomaly " + (save_error or f"state saved to {args.anomaly_state} again"),
+                              file=sys.stderr)
+                if ring is None:
+                    ring = SharedRingWriter(args.shm, sample.keys(), args.capacity, {
+                        "version": version,
+                        "soc": soc_info_dict,
+                        "interval": args.interval,
+                    })
+                ring.write(sample)
+                if stream is not None:
+                    stream.publish(sample)
+            if frames:
+                supervisor.received()
+            elif not pipeline.pending:
+                if supervisor.check():
+                    data = b''
+                if supervisor.failed():
+                    print(f"powermetrics failed to restart {supervisor.failures} times in a row, giving up",
+                          file=sys.stderr)
+                    return 1
+    except KeyboardInterrupt:
+        print("Stopping...")
+    finally:
+        samplers.stop()
+        if ring is not None:
+            ring.close()
+        if stream is not None:
+            stream.stop()
+        pipeline.close()
+        if detector is not None and not detector.save(args.anomaly_state):
+            print("anomaly " + detector.error, file=sys.stderr)
+        powermetrics_process.terminate()
+    return 0
 
-    return 
 
 def main():
-    global powermetrics_process
+    global powermetrics_process, args
+    args = parser.parse_args()
+    if args.command == 'analyze':
+        from macpm.analyze import analyze_main
+        return analyze_main(args)
+    if args.command == 'diff':
+        from macpm.diff import diff_main
+        return diff_main(args)
+    if args.command == 'soak':
+        from macpm.soak import soak_main
+        return soak_main(args)
+    if args.command == 'bench':
+        from macpm.parse_pool import bench_main
+        return bench_main(args)
+    if args.layout:
+        # fail before powermetrics and curses start
+        read_layout(args.layout)
+    if args.command == 'daemon':
+        if not args.powermetrics:
+            pause = os.popen("sudo echo").read()
+        start_powermetrics()
+        return run_daemon()
+    if args.attach:
+        # the daemon's interval sizes the rolling averages
+        try:
+            args.interval = SharedRingReader(args.attach).meta["interval"]
+        except FileNotFoundError:
+            raise SystemExit(f"no macpm daemon publishing at {args.attach}, start `sudo macpm daemon`")
+        return run_ui()
     print(f"\n{version} - enhanced MAC Performance monitoring CLI tool for Apple Silicon")
     print("You can update macpm by running `pip install macpm --upgrade`")
     print("Get help at `https://github.com/visualcjy/macpm`")
     print("P.S. You are recommended to run macpm with `sudo macpm`\n")
     print("\n[1/3] Loading macpm\n")
     print("\n[2/3] Starting powermetrics process\n")
-    pause = os.popen("sudo echo").read()
-    command = " ".join([
-        "sudo nice -n",
-        str(10),
-        "powermetrics",
-        "--samplers cpu_power,gpu_power,thermal,network,disk",
-        "-f plist",
-        "-i",
-        str(args.interval * 1000)
-    ])
-    powermetrics_process = subprocess.Popen(command.split(" "), stdin=PIPE, stdout=PIPE)
+    if not args.powermetrics:
+        pause = os.popen("sudo echo").read()
+    start_powermetrics()
 
     print("\n[3/3] Waiting for first reading...\n")
+    return run_ui()
+
+
+def run_ui():
     print("\033[?25l")
-    curses.wrapper(begin)
+    error = curses.wrapper(begin)
     print("\033[?25h")
+    if error:
+        print(error, file=sys.stderr)
+        return 1
 
 if __name__ == "__main__":
 
-    main()
+    # analyze/diff/soak gate CI through the exit status
+    status = main()
  
+    if powermetrics_process is None:
+        sys.exit(status)
     try:
         powermetrics_process.terminate()
         print("Successfully terminated powermetrics process")
@@ -957,4 +1876,5 @@ if __name__ == "__main__":
         print(e)
         powermetrics_process.terminate()
         print("Successfully terminated powermetrics process")
+    sys.exit(status)
 
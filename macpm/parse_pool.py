@@ -0,0 +1,142 @@
+import os
+import plistlib
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# field tuple -> layout id, per worker process. A worker sends the field
+# names only the first time it sees a layout, afterwards just the values.
+worker_layouts = {}
+
+
+def parse_frame(frame):
+    from macpm.macpm import flatten_sample
+    start = time.perf_counter()
+    sample = flatten_sample(plistlib.loads(frame))
+    fields = tuple(sample)
+    layout = worker_layouts.get(fields)
+    new = layout is None
+    if new:
+        layout = worker_layouts[fields] = (os.getpid(), len(worker_layouts))
+    values = np.fromiter(sample.values(), dtype=np.float64, count=len(fields)).tobytes()
+    return layout, fields if new else None, values, time.perf_counter() - start
+
+
+class ParsePipeline():
+    # turns powermetrics frames into samples, in order. Frames are parsed
+    # inline until parsing keeps more than `high` of a core busy, then they
+    # go to a pool of `workers` processes until the load drops below `low`.
+    # workers=0 always parses inline.
+    def __init__(self, workers=0, high=0.5, low=0.2, window=2.0):
+        # leave a core for the main loop
+        self.workers = max(min(workers, (os.cpu_count() or 1) - 1), 0)
+        self.high = high
+        self.low = low
+        self.window = window
+        self.pool = None
+        self.parallel = False
+        self.pending = deque()
+        self.layouts = {}
+        self.busy = 0.0
+        self.window_start = time.monotonic()
+        self.load = 0.0
+
+    def parse(self, frame):
+        from macpm.macpm import flatten_sample
+        start = time.perf_counter()
+        sample = flatten_sample(plistlib.loads(frame))
+        self.busy += time.perf_counter() - start
+        return sample
+
+    def collect(self, wait=False):
+        samples = []
+        while self.pending and (wait or self.pending[0].done()):
+            layout, fields, values, busy = self.pending.popleft().result()
+            if fields is not None:
+                self.layouts[layout] = fields
+            samples.append(dict(zip(self.layouts[layout], np.frombuffer(values).tolist())))
+            self.busy += busy
+        return samples
+
+    def feed(self, frames):
+        # samples that are ready, oldest first; inline parsing waits for the
+        # pool to drain so the order never changes
+        samples = self.collect(wait=not self.parallel)
+        for frame in frames:
+            if self.parallel:
+                self.pending.append(self.pool.submit(parse_frame, frame))
+            else:
+                samples.append(self.parse(frame))
+        samples.extend(self.collect())
+        self.adapt()
+        return samples
+
+    def adapt(self):
+        now = time.monotonic()
+        if now - self.window_start < self.window:
+            return
+        self.load = self.busy / (now - self.window_start)
+        self.busy = 0.0
+        self.window_start = now
+        if not self.parallel and self.workers and self.load > self.high:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.workers)
+            self.parallel = True
+        elif self.parallel and self.load < self.low:
+            self.parallel = False
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+
+def benchmark(topology="m1-ultra", tasks=(0, 50, 200, 800), workers=(2, 4), count=200):
+    # frames per second parsed inline and on pools of each size, for frames
+    # of growing size; the pool wins once a frame costs more than shipping it
+    from macpm.fake_powermetrics import FakePowermetrics
+    rows = []
+    for n_tasks in tasks:
+        fake = FakePowermetrics(topology, "random", 60, n_tasks, True)
+        frames = [plistlib.dumps(fake.sample(50000000)) for _ in range(count)]
+        inline = ParsePipeline()
+        start = time.perf_counter()
+        inline.feed(frames)
+        inline_rate = count / (time.perf_counter() - start)
+        row = {"tasks": n_tasks, "frame_kB": sum(map(len, frames)) / count / 1000,
+               "inline_fps": inline_rate, "pool_fps": {}}
+        for n in workers:
+            pipeline = ParsePipeline()
+            pipeline.pool = ProcessPoolExecutor(max_workers=n)
+            pipeline.parallel = True
+            # start the workers and import macpm in them before timing
+            pipeline.feed(frames[:n * 2])
+            pipeline.collect(wait=True)
+            start = time.perf_counter()
+            pipeline.feed(frames)
+            pipeline.collect(wait=True)
+            row["pool_fps"][n] = count / (time.perf_counter() - start)
+            pipeline.close()
+        rows.append(row)
+    return rows
+
+
+def format_benchmark(rows):
+    workers = list(rows[0]["pool_fps"]) if rows else []
+    lines = [f"frames/s on {os.cpu_count()} CPUs",
+             f"{'tasks':>6}{'frame':>10}{'inline':>10}" + "".join(f"{f'pool x{n}':>10}" for n in workers)
+             + "   best"]
+    for row in rows:
+        best = max(row["pool_fps"], key=row["pool_fps"].get, default=None)
+        winner = "inline" if best is None or row["inline_fps"] >= row["pool_fps"][best] else f"pool x{best}"
+        lines.append(f"{row['tasks']:>6}{row['frame_kB']:>8.0f}kB{row['inline_fps']:>8.0f}/s"
+                     + "".join(f"{row['pool_fps'][n]:>8.0f}/s" for n in workers) + f"   {winner}")
+    return "\n".join(lines)
+
+
+def bench_main(args):
+    rows = benchmark(args.topology, args.tasks, args.workers, args.frames)
+    print(format_benchmark(rows))
+    return 0
@@ -0,0 +1,56 @@
+import json
+import struct
+import sys
+from array import array
+
+# file layout: magic, header length, JSON header (padded to 8 bytes),
+# then one little-endian float64 row per sample
+MAGIC = b'MACPMREC'
+HEADER_LEN = struct.Struct('<I')
+
+
+class RecordingWriter():
+    def __init__(self, path, fields, meta=None):
+        self.fields = list(fields)
+        header = dict(meta or {})
+        header["fields"] = self.fields
+        header = json.dumps(header).encode()
+        offset = len(MAGIC) + HEADER_LEN.size + len(header)
+        header += b' ' * (-offset % 8)
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC + HEADER_LEN.pack(len(header)) + header)
+        self.file.flush()
+
+    def write(self, sample):
+        row = array('d', [sample.get(f, float('nan')) for f in self.fields])
+        if sys.byteorder != 'little':
+            row.byteswap()
+        self.file.write(row.tobytes())
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a macpm recording")
+        header_len, = HEADER_LEN.unpack(f.read(HEADER_LEN.size))
+        header = json.loads(f.read(header_len))
+    return header, len(MAGIC) + HEADER_LEN.size + header_len
+
+
+def load_recording(path):
+    # returns the header and a read-only (samples, fields) memory map;
+    # a partially written last row is ignored
+    import numpy as np
+    import os
+    header, offset = read_header(path)
+    ncols = len(header["fields"])
+    nrows = (os.path.getsize(path) - offset) // (8 * ncols)
+    if nrows == 0:
+        return header, np.empty((0, ncols))
+    data = np.memmap(path, dtype='<f8', mode='r', offset=offset, shape=(nrows, ncols))
+    return header, data
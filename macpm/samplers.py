@@ -0,0 +1,107 @@
+import threading
+import time
+
+import psutil
+
+
+class Sampler():
+    # calls fn every `interval` seconds on its own thread and keeps the
+    # latest (timestamp, values) so readers never wait for a measurement
+    def __init__(self, name, fn, interval):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.latest = (None, {})
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        try:
+            values = self.fn()
+        except Exception:
+            # a failing source only loses its own fields
+            values = {}
+        self.latest = (time.time(), values)
+
+    def run(self):
+        while not self.stopped.is_set():
+            start = time.monotonic()
+            self.sample()
+            self.stopped.wait(max(self.interval - (time.monotonic() - start), 0))
+
+    def start(self):
+        # take the first reading right away so the first frame has data
+        self.sample()
+        self.thread = threading.Thread(target=self.run, name="macpm-" + self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+
+class SamplerRegistry():
+    # sources that are not tied to the powermetrics interval. Their latest
+    # values are merged into each powermetrics sample as <name>_<field>,
+    # with <name>_timestamp saying when they were measured.
+    def __init__(self):
+        self.samplers = []
+
+    def register(self, name, fn, interval):
+        if interval and interval > 0:
+            self.samplers.append(Sampler(name, fn, interval))
+
+    def start(self):
+        for sampler in self.samplers:
+            sampler.start()
+
+    def stop(self):
+        for sampler in self.samplers:
+            sampler.stop()
+
+    def merge(self, sample):
+        for sampler in self.samplers:
+            timestamp, values = sampler.latest
+            if timestamp is None or not values:
+                continue
+            # a slow sampler's value can be older than the sample it joins
+            sample[sampler.name + "_timestamp"] = timestamp
+            for key, value in values.items():
+                if value is not None:
+                    sample[sampler.name + "_" + key] = value
+        return sample
+
+
+def rate_sampler(read_counters, fields):
+    # turns cumulative per-device counters into per-second rates;
+    # fields maps counter attribute -> output suffix
+    previous = {}
+    def sample():
+        now = time.monotonic()
+        counters = read_counters() or {}
+        values = {}
+        for device, counter in counters.items():
+            # a device seen for the first time reports 0 so its fields exist from the start
+            last_time, last = previous.get(device, (now, counter))
+            elapsed = now - last_time
+            for attr, suffix in fields.items():
+                delta = max(getattr(counter, attr) - getattr(last, attr), 0)
+                values[device + "_" + suffix] = delta / elapsed if elapsed > 0 else 0.0
+            previous[device] = (now, counter)
+        return values
+    return sample
+
+
+def network_sampler():
+    return rate_sampler(lambda: psutil.net_io_counters(pernic=True), {
+        "bytes_recv": "in_Bps",
+        "bytes_sent": "out_Bps",
+    })
+
+
+def disk_sampler():
+    return rate_sampler(lambda: psutil.disk_io_counters(perdisk=True), {
+        "read_count": "read_iops",
+        "write_count": "write_iops",
+        "read_bytes": "read_Bps",
+        "write_bytes": "write_Bps",
+    })
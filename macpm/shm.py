@@ -0,0 +1,172 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+# Shared memory ring written by `macpm daemon` and read by any number of
+# unprivileged clients. Layout:
+#   0   magic
+#   8   u32 meta length, u32 field count, u64 capacity
+#   24  u64 sequence (odd while the writer updates the header), u64 head
+#   64  JSON meta (fields, soc info, interval), padded to 8 bytes
+#   ... capacity slots of float64: [sample index, field values...]
+# The sample index in column 0 is a per-slot sequence number: the writer
+# sets it to -1, writes the values and then stamps the index, with a
+# barrier between each step. A reader reads the stamps, copies the values
+# and reads the stamps again; a slot is valid when both reads match its
+# index, so readers never need a lock.
+MAGIC = b'MACPMSHM'
+LAYOUT = struct.Struct('<8sIIQ')
+SEQ_OFFSET = 24
+HEADER_SIZE = 64
+# fixed, not tempfile.gettempdir(): sudo resets TMPDIR, so the daemon and
+# unprivileged clients would look in different directories
+default_path = "/tmp/macpm.shm"
+
+_fence = threading.Lock()
+_fence.acquire()
+
+
+def barrier():
+    # Python has no memory fence. A lock release followed by an acquire is
+    # a store-release then an atomic read-modify-write with acquire, which
+    # keeps the stores before it ahead of the stores after it on x86 and
+    # arm64 alike (plain numpy stores give no such order on arm64).
+    _fence.release()
+    _fence.acquire()
+
+
+class SharedRingWriter():
+    def __init__(self, path, fields, capacity=3600, meta=None):
+        self.fields = list(fields)
+        header = dict(meta or {})
+        header["fields"] = self.fields
+        header = json.dumps(header).encode()
+        header += b' ' * (-len(header) % 8)
+        self.data_offset = HEADER_SIZE + len(header)
+        self.row_size = len(self.fields) + 1
+        self.capacity = capacity
+        size = self.data_offset + capacity * self.row_size * 8
+        # build the file next to its final name and swap it in, so clients
+        # never map a half-initialized ring
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".macpm-")
+        os.fchmod(fd, 0o644)
+        os.ftruncate(fd, size)
+        self.mm = mmap.mmap(fd, size)
+        os.close(fd)
+        self.mm[:LAYOUT.size] = LAYOUT.pack(MAGIC, len(header), len(self.fields), capacity)
+        self.mm[HEADER_SIZE:self.data_offset] = header
+        self.counters = np.frombuffer(self.mm, dtype='<u8', count=2, offset=SEQ_OFFSET)
+        self.slots = np.frombuffer(self.mm, dtype='<f8', offset=self.data_offset).reshape(capacity, self.row_size)
+        self.slots[:, 0] = -1
+        os.replace(tmp_path, path)
+        self.path = path
+
+    def write(self, sample):
+        seq, head = self.counters
+        row = self.slots[head % self.capacity]
+        self.counters[0] = seq + 1
+        row[0] = -1
+        barrier()
+        row[1:] = [sample.get(f, np.nan) for f in self.fields]
+        barrier()
+        row[0] = head
+        barrier()
+        self.counters[1] = head + 1
+        barrier()
+        self.counters[0] = seq + 2
+
+    def close(self):
+        del self.counters, self.slots
+        self.mm.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class SharedRingReader():
+    def __init__(self, path=default_path):
+        self.path = path
+        self.attach()
+
+    def attach(self):
+        with open(self.path, 'rb') as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, meta_len, nfields, capacity = LAYOUT.unpack(self.mm[:LAYOUT.size])
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a macpm shared ring")
+        self.meta = json.loads(self.mm[HEADER_SIZE:HEADER_SIZE + meta_len])
+        self.fields = self.meta["fields"]
+        self.index = {name: i for i, name in enumerate(self.fields)}
+        self.capacity = capacity
+        self.counters = np.frombuffer(self.mm, dtype='<u8', count=2, offset=SEQ_OFFSET)
+        # zero-copy view of the whole ring, column 0 is the sample index
+        self.slots = np.frombuffer(self.mm, dtype='<f8', offset=HEADER_SIZE + meta_len).reshape(capacity, nfields + 1)
+        self.next = self.head()
+        self.idle_since = time.monotonic()
+
+    def head(self):
+        while True:
+            seq = int(self.counters[0])
+            barrier()
+            head = int(self.counters[1])
+            barrier()
+            if seq % 2 == 0 and seq == int(self.counters[0]):
+                return head
+            time.sleep(0)
+
+    def read_rows(self, start, stop):
+        # copy rows start..stop-1; returns (indices, values) of the ones
+        # that were not overwritten while they were copied
+        indices = np.arange(start, stop)
+        slots = indices % self.capacity
+        before = self.slots[slots, 0]
+        barrier()
+        values = self.slots[slots, 1:]
+        barrier()
+        after = self.slots[slots, 0]
+        valid = (before == indices) & (after == indices)
+        return indices[valid], values[valid]
+
+    def read(self):
+        # samples published since the last call, oldest first, as one
+        # (samples, fields) array; self.index maps a field to its column.
+        # This copy is the only one: it has to be checked against the
+        # writer, a view into the ring could change under the caller.
+        head = self.head()
+        if head < self.next:
+            # the daemon started over
+            self.next = 0
+        start = max(self.next, head - self.capacity + 1)
+        indices, rows = self.read_rows(start, head)
+        self.next = head
+        if len(rows):
+            self.idle_since = time.monotonic()
+        elif time.monotonic() - self.idle_since > 2:
+            self.reattach_if_replaced()
+        return rows
+
+    def latest(self):
+        # the newest sample as a row of self.fields, or None
+        head = self.head()
+        if head == 0:
+            return None
+        indices, rows = self.read_rows(head - 1, head)
+        return rows[0] if len(rows) else None
+
+    def reattach_if_replaced(self):
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            return
+        if inode != self.inode:
+            del self.counters, self.slots
+            self.mm.close()
+            self.attach()
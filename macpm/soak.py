@@ -0,0 +1,178 @@
+import contextlib
+import curses
+import os
+import plistlib
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import psutil
+
+# Long-run harness: pushes samples through parsing, the samplers, the
+# catch-up merge and DefaultView.display (rendered to /dev/null) with view
+# switches, color changes and ctrl+r through the live key handler along the
+# way, and watches memory and frame time. Only reading powermetrics and the
+# terminal is left out.
+#   macpm soak --samples 200000 --topology m1-ultra --tasks 50 --no_tracemalloc
+#   macpm soak --replay run.rec
+
+# keys pressed in turn every --keys_every samples
+soak_keys = [ord('2'), ord('3'), ord('1'), ord('l'), curses.KEY_LEFT, curses.KEY_RIGHT, ord('l')]
+
+
+def synthetic_samples(topology, tasks, pool, parse=True):
+    # a pool of distinct fake powermetrics frames, parsed again on every use
+    # unless parse is False
+    from macpm.fake_powermetrics import FakePowermetrics
+    from macpm.parse_pool import ParsePipeline
+    fake = FakePowermetrics(topology, "random", 60, tasks, True)
+    frames = [plistlib.dumps(fake.sample(1000000000)) for _ in range(pool)]
+    pipeline = ParsePipeline()
+    if not parse:
+        parsed = pipeline.feed(frames)
+        while True:
+            for sample in parsed:
+                yield dict(sample)
+    while True:
+        for frame in frames:
+            yield pipeline.feed([frame])[0]
+
+
+def replayed_samples(path):
+    from macpm.recording import load_recording
+    header, data = load_recording(path)
+    fields = header["fields"]
+    if not len(data):
+        raise SystemExit(f"{path} has no samples")
+    while True:
+        for row in data:
+            yield dict(zip(fields, row.tolist()))
+
+
+def soc_info_for(sample):
+    cores = {key[:-7] for key in sample if key.endswith("_active") and key[:-7][-1:].isdigit()}
+    e_cores = sum(1 for key in cores if key.startswith("E-Cluster"))
+    from macpm.macpm import set_soc_limits
+    return set_soc_limits({
+        "name": "Soak",
+        "core_count": len(cores),
+        "e_core_count": e_cores,
+        "p_core_count": len(cores) - e_cores,
+        "gpu_core_count": "?",
+    })
+
+
+def soak(args, samples, soc_info_dict=None):
+    import macpm.macpm as app
+    from blessed import Terminal
+    os.environ["COLUMNS"], os.environ["LINES"] = (str(n) for n in args.size)
+    sink = open(os.devnull, "w")
+    terminal = Terminal(kind="xterm-256color", stream=sink, force_styling=True)
+    process = psutil.Process()
+    if args.tracemalloc:
+        tracemalloc.start(1)
+    baseline = None
+    frame_times = np.zeros(args.samples)
+    checkpoints = []
+    samplers = app.create_samplers()
+    samplers.start()
+    max_lag = app.catch_up_lag()
+    pending = []
+    view1 = None
+    try:
+        with contextlib.redirect_stdout(sink):
+            for i in range(args.samples):
+                start = time.perf_counter()
+                if args.backlog_every and i and i % args.backlog_every == 0:
+                    # samples that piled up during a stall, older than max_lag
+                    for _ in range(args.backlog):
+                        late = next(samples)
+                        late["timestamp"] = time.time() - 2 * max_lag
+                        pending.append(late)
+                sample = next(samples)
+                sample["timestamp"] = time.time()
+                pending.append(sample)
+                sample, merged = app.take_sample(pending, max_lag)
+                samplers.merge(sample)
+                if view1 is None:
+                    soc_info_dict = soc_info_dict or soc_info_for(sample)
+                    view1 = app.DefaultView(soc_info_dict, args)
+                if args.keys_every and i and i % args.keys_every == 0:
+                    app.handle_key(soak_keys[i // args.keys_every % len(soak_keys)], view1, soc_info_dict)
+                if args.reset_every and i and i % args.reset_every == 0:
+                    app.handle_key(0x12, view1, soc_info_dict)
+                # dashing creates a Terminal per layout, point it at the sink
+                view1.ui._terminal = terminal
+                view1.status = app.frame_status(sample, merged, 0)
+                view1.display(sample, args)
+                frame_times[i] = time.perf_counter() - start
+                if (i + 1) % args.window == 0:
+                    window = frame_times[i + 1 - args.window:i + 1]
+                    checkpoints.append({
+                        "samples": i + 1,
+                        "rss_MB": process.memory_info().rss / 1e6,
+                        "traced_MB": tracemalloc.get_traced_memory()[0] / 1e6 if args.tracemalloc else 0.0,
+                        "mean_ms": float(window.mean() * 1000),
+                        "p99_ms": float(np.percentile(window, 99) * 1000),
+                    })
+                    if args.tracemalloc and baseline is None and i + 1 >= args.warmup:
+                        baseline = tracemalloc.take_snapshot()
+                    if args.progress:
+                        print(format_checkpoint(checkpoints[-1]), file=sys.stderr, flush=True)
+    finally:
+        samplers.stop()
+    top = []
+    if args.tracemalloc:
+        if baseline is not None:
+            top = tracemalloc.take_snapshot().compare_to(baseline, "lineno")[:args.top]
+        tracemalloc.stop()
+    return checkpoints, top
+
+
+def format_checkpoint(c):
+    return (f"{c['samples']:>10}{c['rss_MB']:>10.1f}{c['traced_MB']:>10.1f}"
+            f"{c['mean_ms']:>10.2f}{c['p99_ms']:>10.2f}")
+
+
+def verdict(checkpoints, args):
+    # growth between the first window after warm-up and the last one
+    settled = [c for c in checkpoints if c["samples"] >= args.warmup]
+    if len(settled) < 2:
+        return [], ["too few windows after warm-up, raise --samples or lower --window"]
+    first, last = settled[0], settled[-1]
+    checks = [
+        ("rss growth", last["rss_MB"] - first["rss_MB"], args.max_rss_growth, "MB"),
+        ("p99 frame time growth", last["p99_ms"] / first["p99_ms"] if first["p99_ms"] else 1.0,
+         args.max_p99_growth, "x"),
+    ]
+    if args.tracemalloc:
+        checks.append(("traced growth", last["traced_MB"] - first["traced_MB"], args.max_rss_growth, "MB"))
+    failures = [f"{name} {value:.2f}{unit} > {limit:g}{unit}" for name, value, limit, unit in checks
+                if value > limit]
+    return checks, failures
+
+
+def soak_main(args):
+    import macpm.macpm as app
+    # `python -m macpm.macpm` runs a second copy of the module, give it the options
+    app.args = args
+    if args.replay:
+        samples = replayed_samples(args.replay)
+    else:
+        samples = synthetic_samples(args.topology, args.tasks, args.pool, args.parse)
+    checkpoints, top = soak(args, samples)
+    checks, failures = verdict(checkpoints, args)
+    print(f"{'samples':>10}{'rss MB':>10}{'traced MB':>10}{'mean ms':>10}{'p99 ms':>10}")
+    for c in checkpoints:
+        print(format_checkpoint(c))
+    if top:
+        print("\ntop allocation growth since warm-up:")
+        for stat in top:
+            print(f"  {stat.size_diff / 1e3:+10.1f} kB {stat.count_diff:+8d} blocks  {stat.traceback[0]}")
+    print()
+    for name, value, limit, unit in checks:
+        print(f"{name:<24}{value:10.2f}{unit:<3} limit {limit:g}{unit}")
+    for failure in failures:
+        print("FAIL: " + failure)
+    return 1 if failures else 0
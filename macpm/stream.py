@@ -0,0 +1,245 @@
+import asyncio
+import base64
+import fnmatch
+import hashlib
+import json
+import math
+import struct
+import threading
+from urllib.parse import urlsplit, parse_qs
+
+# Local live stream of samples for browsers and other tools.
+#   GET /fields                      JSON list of the sample fields
+#   GET /stream?fields=cpu_W,P-*     Server-Sent Events
+#   GET /ws?fields=...               WebSocket (text frames)
+# fields takes comma separated names or shell patterns, default all.
+# Browsers may only connect from localhost pages (checked on the Origin
+# header), so a web page elsewhere cannot read the machine's telemetry.
+# Every message is {"seq": n, "values": {...}}; the first one (and the one
+# after a client fell behind) has "full": true and every subscribed field,
+# the others only carry the fields that changed for that client.
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# samples queued per client before it is resynced with a full message
+client_queue_size = 16
+
+
+local_hosts = {"localhost", "127.0.0.1", "::1"}
+
+
+def local_origin(origin):
+    # requests without an Origin come from tools, not web pages
+    if not origin:
+        return True
+    try:
+        return urlsplit(origin).hostname in local_hosts
+    except ValueError:
+        return False
+
+
+def parse_address(text, default_host="127.0.0.1"):
+    host, _, port = text.rpartition(":")
+    return host or default_host, int(port)
+
+
+class StreamClient():
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.queue = asyncio.Queue(maxsize=client_queue_size)
+        self.fields = None
+        self.last = {}
+        self.resync = True
+
+    def subscribe(self, sample):
+        if self.fields is None:
+            self.fields = [name for name in sample
+                           if not self.patterns or any(fnmatch.fnmatchcase(name, p) for p in self.patterns)]
+        return self.fields
+
+    def offer(self, seq, sample):
+        if self.queue.full():
+            # a slow client skips samples and gets a full message afterwards
+            self.queue.get_nowait()
+            self.resync = True
+        self.queue.put_nowait((seq, sample))
+
+    def encode(self, seq, sample):
+        message = {"seq": seq}
+        values = {}
+        for name in self.subscribe(sample):
+            value = sample.get(name)
+            if isinstance(value, float) and not math.isfinite(value):
+                value = None
+            if self.resync or self.last.get(name) != value:
+                values[name] = value
+                self.last[name] = value
+        if self.resync:
+            message["full"] = True
+            self.resync = False
+        message["values"] = values
+        return json.dumps(message, separators=(",", ":"))
+
+
+class StreamServer():
+    # asyncio server on its own thread; publish() only hands the sample over,
+    # all encoding and writing happens on the server loop
+    def __init__(self, host="127.0.0.1", port=8787):
+        self.host = host
+        self.port = port
+        self.clients = set()
+        self.seq = 0
+        self.latest = {}
+        self.loop = None
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        ready = threading.Event()
+        errors = []
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            try:
+                self.server = self.loop.run_until_complete(
+                    asyncio.start_server(self.handle, self.host, self.port))
+                self.port = self.server.sockets[0].getsockname()[1]
+            except OSError as e:
+                errors.append(e)
+                ready.set()
+                return
+            ready.set()
+            self.loop.run_forever()
+            # let open connections run their finally blocks before closing
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, name="macpm-stream", daemon=True)
+        self.thread.start()
+        ready.wait()
+        if errors:
+            raise errors[0]
+        return self
+
+    def stop(self):
+        if self.loop is not None and self.server is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=1)
+
+    def publish(self, sample):
+        self.latest = sample
+        if self.clients:
+            self.loop.call_soon_threadsafe(self.fan_out, sample)
+
+    def fan_out(self, sample):
+        self.seq += 1
+        for client in self.clients:
+            client.offer(self.seq, sample)
+
+    async def handle(self, reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        lines = request.decode("latin-1").split("\r\n")
+        method, target = (lines[0].split(" ") + ["", ""])[:2]
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        patterns = [p for item in query.get("fields", []) for p in item.split(",") if p]
+        origin = headers.get("origin", "")
+        try:
+            if not local_origin(origin):
+                await self.respond(writer, "403 Forbidden", "text/plain", b"only localhost pages may connect\n")
+            elif method != "GET":
+                await self.respond(writer, "405 Method Not Allowed", "text/plain", b"GET only\n")
+            elif url.path == "/fields":
+                await self.respond(writer, "200 OK", "application/json", json.dumps(list(self.latest)).encode())
+            elif url.path == "/stream":
+                await self.serve_events(writer, origin, StreamClient(patterns))
+            elif url.path == "/ws" and headers.get("upgrade", "").lower() == "websocket":
+                await self.serve_websocket(reader, writer, headers, StreamClient(patterns))
+            else:
+                await self.respond(writer, "404 Not Found", "text/plain", b"try /stream, /ws or /fields\n")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, content_type, body):
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+
+    async def serve_events(self, writer, origin, client):
+        # a localhost page on another port needs its origin allowed
+        allow = f"Access-Control-Allow-Origin: {origin}\r\nVary: Origin\r\n" if origin else ""
+        writer.write(("HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                      f"Cache-Control: no-cache\r\n{allow}\r\n").encode())
+        await writer.drain()
+        self.clients.add(client)
+        try:
+            while True:
+                seq, sample = await client.queue.get()
+                writer.write(f"id: {seq}\ndata: {client.encode(seq, sample)}\n\n".encode())
+                await writer.drain()
+        finally:
+            self.clients.discard(client)
+
+    async def serve_websocket(self, reader, writer, headers, client):
+        accept = base64.b64encode(hashlib.sha1((headers.get("sec-websocket-key", "") + WS_GUID).encode()).digest())
+        writer.write(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                     b"Connection: Upgrade\r\nSec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        await writer.drain()
+        self.clients.add(client)
+        # the client only ever sends control frames; a close or EOF ends the stream
+        closed = asyncio.ensure_future(self.read_until_close(reader))
+        try:
+            while not closed.done():
+                get = asyncio.ensure_future(client.queue.get())
+                done, _ = await asyncio.wait([get, closed], return_when=asyncio.FIRST_COMPLETED)
+                if get not in done:
+                    get.cancel()
+                    break
+                seq, sample = get.result()
+                writer.write(websocket_frame(client.encode(seq, sample).encode()))
+                await writer.drain()
+            writer.write(websocket_frame(b"", opcode=0x8))
+        finally:
+            closed.cancel()
+            self.clients.discard(client)
+
+    async def read_until_close(self, reader):
+        # a dropped connection ends the stream like a close frame
+        try:
+            while True:
+                head = await reader.readexactly(2)
+                length = head[1] & 0x7F
+                if length == 126:
+                    length = struct.unpack(">H", await reader.readexactly(2))[0]
+                elif length == 127:
+                    length = struct.unpack(">Q", await reader.readexactly(8))[0]
+                await reader.readexactly(length + (4 if head[1] & 0x80 else 0))
+                if head[0] & 0x0F == 0x8:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return
+
+
+def websocket_frame(payload, opcode=0x1):
+    length = len(payload)
+    if length < 126:
+        header = struct.pack(">BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+    return header + payload
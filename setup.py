@@ -15,7 +15,8 @@ setup(
     packages=find_packages(),
     entry_points={
             'console_scripts': [
-                'macpm = macpm.macpm:main'
+                'macpm = macpm.macpm:main',
+                'macpm-fake-powermetrics = macpm.fake_powermetrics:main'
             ]
     },
     classifiers=(
@@ -28,6 +29,7 @@ setup(
         "dashing",
         "psutil",
         "humanize",
+        "numpy",
     ],
     zip_safe=False
 )
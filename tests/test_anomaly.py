@@ -0,0 +1,47 @@
+import numpy as np
+
+from macpm.anomaly import AnomalyDetector
+
+
+def busy_sample(package_W):
+    return {"timestamp": 1700000000.0, "package_W": package_W, "cpu_W": 3.0, "gpu_W": 1.0,
+            "P-Cluster_active": 60.0, "E-Cluster_active": 30.0, "gpu_active": 20.0,
+            "P-Cluster_freq_Mhz": 3000.0, "E-Cluster_freq_Mhz": 2000.0, "gpu_freq_MHz": 1000.0}
+
+
+def test_baselines_survive_restarts(tmp_path):
+    path = str(tmp_path / "state" / "anomaly.npz")
+    detector = AnomalyDetector(warmup=5, state_path=path)
+    for i in range(50):
+        detector.update(busy_sample(10.0 + i % 3 * 0.1))
+    assert detector.save(path)
+    restarted = AnomalyDetector(warmup=5, state_path=path)
+    assert np.array_equal(restarted.mean, detector.mean)
+    assert np.array_equal(restarted.var, detector.var)
+    assert np.array_equal(restarted.count, detector.count)
+    # the restored baseline flags a spike without a new warmup
+    assert restarted.update(busy_sample(30.0)) == ["package_power"]
+
+
+def test_bad_state_starts_fresh(tmp_path):
+    path = tmp_path / "anomaly.npz"
+    detector = AnomalyDetector(warmup=5)
+    detector.update(busy_sample(10.0))
+    assert detector.save(str(path))
+    data = path.read_bytes()
+    path.write_bytes(data[:len(data) // 2])
+    assert not AnomalyDetector().load(str(path))
+    np.savez(path, names=np.array(detector.names), mean=detector.mean)
+    fresh = AnomalyDetector(state_path=str(path))
+    assert not fresh.count.any()
+
+
+def test_unwritable_state_is_reported(tmp_path):
+    # a file where the state directory should be
+    (tmp_path / "state").write_text("")
+    path = str(tmp_path / "state" / "anomaly.npz")
+    detector = AnomalyDetector(state_path=path, checkpoint_every=0)
+    detector.update(busy_sample(10.0))
+    assert detector.error
+    assert not detector.save(path)
+    assert list(tmp_path.iterdir()) == [tmp_path / "state"]
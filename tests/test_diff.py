@@ -0,0 +1,57 @@
+import json
+
+import numpy as np
+
+from macpm.diff import diff_main
+from macpm.macpm import parser
+from macpm.recording import RecordingWriter
+
+
+def write_recording(path, package_W, count=200, seed=0):
+    rng = np.random.default_rng(seed)
+    fields = ["timestamp", "interval", "package_W", "cpu_W", "gpu_W", "P-Cluster_active", "thermal_pressure"]
+    recorder = RecordingWriter(path, fields, {"interval": 1})
+    for i in range(count):
+        recorder.write({
+            "timestamp": 1000.0 + i,
+            "interval": 1.0,
+            "package_W": package_W + rng.normal(0, 0.1),
+            "cpu_W": 2.0 + rng.normal(0, 0.1),
+            # an idle GPU makes its relative changes 0/0
+            "gpu_W": 0.0,
+            "P-Cluster_active": 50.0,
+            "thermal_pressure": 0.0,
+        })
+    recorder.close()
+    return str(path)
+
+
+def run_diff(capsys, *argv):
+    status = diff_main(parser.parse_args(["diff", *argv, "--iterations", "200", "--seed", "1"]))
+    return status, capsys.readouterr().out
+
+
+def test_exit_status_gates_on_thresholds(tmp_path, capsys):
+    a = write_recording(tmp_path / "a.rec", 5.0, seed=1)
+    b = write_recording(tmp_path / "b.rec", 10.0, seed=2)
+    status, out = run_diff(capsys, a, b)
+    assert status == 1
+    assert "FAIL" in out
+    status, out = run_diff(capsys, a, b, "--threshold", "package_energy=", "--threshold", "package_p95=")
+    assert status == 0
+    assert "FAIL" not in out
+    # the same recording never regresses
+    assert run_diff(capsys, a, a)[0] == 0
+
+
+def test_json_is_strict(tmp_path, capsys):
+    a = write_recording(tmp_path / "a.rec", 5.0, seed=1)
+    b = write_recording(tmp_path / "b.rec", 10.0, seed=2)
+    status, out = run_diff(capsys, a, b, "--json")
+    assert status == 1
+
+    def refuse(constant):
+        raise ValueError(constant)
+    results = {r["metric"]: r for r in json.loads(out, parse_constant=refuse)}
+    assert results["package_energy"]["failed"]
+    assert results["gpu_energy"]["change"] is None
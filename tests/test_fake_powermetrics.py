@@ -0,0 +1,22 @@
+import plistlib
+
+import pytest
+
+from macpm.fake_powermetrics import FakePowermetrics, parse_topology
+from macpm.macpm import flatten_sample
+
+
+@pytest.mark.parametrize("topology", ["m1", "m1-max", "m1-ultra", "synthetic:4", "synthetic:8",
+                                      "synthetic:16", "synthetic:24", "synthetic:32", "synthetic:40",
+                                      "synthetic:128"])
+def test_every_topology_parses(topology):
+    fake = FakePowermetrics(topology, "random", 60, 5, True)
+    sample = flatten_sample(plistlib.loads(plistlib.dumps(fake.sample(1000000000))))
+    name, clusters, down_ratio = parse_topology(topology)
+    cores = [key for key in sample if key.endswith("_active") and key[:-7][-1:].isdigit()]
+    assert len(cores) == sum(n for cluster, n in clusters)
+    for kind in "EP":
+        # the summary fields cover every cluster of the kind
+        freqs = [sample[cluster + "_freq_Mhz"] for cluster, n in clusters if cluster[0] == kind]
+        assert sample[kind + "-Cluster_freq_Mhz"] == max(freqs)
+        assert 0 <= sample[kind + "-Cluster_active"] <= 100
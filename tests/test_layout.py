@@ -0,0 +1,21 @@
+import pytest
+
+from macpm.macpm import check_layout, parse_layout
+
+
+@pytest.mark.parametrize("layout", [
+    parse_layout("power:-1,disk:1"),
+    parse_layout("power:nan,disk"),
+    parse_layout("heatmap|power:0"),
+    parse_layout("power:inf"),
+    {"columns": ["power", {"rows": ["disk"], "size": "big"}]},
+    {"columns": ["power", {"rows": ["disk"], "size": -2}]},
+])
+def test_bad_sizes_are_refused(layout):
+    with pytest.raises(SystemExit, match="bad size"):
+        check_layout(layout, [])
+
+
+def test_sizes_above_zero_pass():
+    check_layout(parse_layout("heatmap|processor,memory,power:2.5,network"), [])
+    check_layout({"columns": ["power", {"rows": ["disk", "network:3"], "size": 2}]}, [])
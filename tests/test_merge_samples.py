@@ -0,0 +1,21 @@
+import math
+
+from macpm.macpm import merge_samples
+
+
+def test_keys_are_averaged_over_the_samples_that_have_them():
+    samples = [
+        {"timestamp": 1.0, "interval": 1.0, "cpu_W": 2.0, "thermal_pressure": 0},
+        {"timestamp": 4.0, "interval": 3.0, "cpu_W": 4.0, "thermal_pressure": 1,
+         "ram_used_GB": 8.0, "ram_timestamp": 3.5},
+        {"timestamp": 5.0, "interval": 1.0, "cpu_W": float("nan"), "thermal_pressure": 0,
+         "ram_used_GB": 6.0, "ram_timestamp": 4.5},
+    ]
+    merged = merge_samples(samples)
+    assert merged["interval"] == 5.0
+    assert merged["timestamp"] == 5.0
+    assert merged["thermal_pressure"] == 1
+    # cpu_W is missing (NaN) in the last sample, ram_used_GB in the first
+    assert math.isclose(merged["cpu_W"], (2.0 * 1 + 4.0 * 3) / 4)
+    assert math.isclose(merged["ram_used_GB"], (8.0 * 3 + 6.0 * 1) / 4)
+    assert merged["ram_timestamp"] == 4.5
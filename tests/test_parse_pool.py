@@ -0,0 +1,29 @@
+import plistlib
+
+from macpm.fake_powermetrics import FakePowermetrics
+from macpm.parse_pool import ParsePipeline
+
+
+def test_samples_stay_in_order_across_switches():
+    fake = FakePowermetrics("m1-max", "random", 60, 50, True)
+    # every frame is told apart by its elapsed_ns, i.e. the sample's interval
+    frames = [plistlib.dumps(fake.sample((i + 1) * 1000000)) for i in range(40)]
+    # adapt() runs on every feed; high and low below force the switches
+    pipeline = ParsePipeline(high=0, low=-1, window=0)
+    pipeline.workers = 2
+    samples = []
+    try:
+        samples += pipeline.feed(frames[:5])
+        assert pipeline.parallel
+        pipeline.low = float("inf")
+        samples += pipeline.feed(frames[5:20])
+        # back to inline while the pool still holds frames
+        assert not pipeline.parallel and pipeline.pending
+        pipeline.low = -1
+        samples += pipeline.feed(frames[20:25])
+        assert pipeline.parallel and not pipeline.pending
+        samples += pipeline.feed(frames[25:40])
+        samples += pipeline.collect(wait=True)
+    finally:
+        pipeline.close()
+    assert [round(s["interval"] * 1000) for s in samples] == list(range(1, 41))
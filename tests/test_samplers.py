@@ -0,0 +1,19 @@
+import time
+
+from macpm.samplers import SamplerRegistry
+
+
+def test_merge_carries_source_time():
+    registry = SamplerRegistry()
+    registry.register("slow", lambda: {"value": 1.0}, 60)
+    registry.register("broken", lambda: 1 / 0, 60)
+    registry.start()
+    try:
+        sample = registry.merge({"timestamp": time.time() + 5})
+    finally:
+        registry.stop()
+    assert sample["slow_value"] == 1.0
+    # the consumer can tell how old the slow value is
+    assert 4 < sample["timestamp"] - sample["slow_timestamp"] < 6
+    # a failing source adds nothing, not even a fresh timestamp
+    assert not [key for key in sample if key.startswith("broken_")]
@@ -0,0 +1,39 @@
+import multiprocessing
+import time
+
+from macpm.shm import SharedRingReader, SharedRingWriter
+
+
+def write_samples(path, count, fields):
+    ring = SharedRingWriter(path, fields, capacity=8, meta={"interval": 1})
+    time.sleep(0.2)
+    for i in range(count):
+        ring.write({f: float(i) for f in fields})
+    time.sleep(0.5)
+    ring.close()
+
+
+def test_reader_never_sees_torn_rows(tmp_path):
+    # a small ring written as fast as possible by another process: every
+    # row handed out must be one whole sample
+    path = str(tmp_path / "ring.shm")
+    fields = [f"f{i}" for i in range(64)]
+    writer = multiprocessing.Process(target=write_samples, args=(path, 20000, fields))
+    writer.start()
+    deadline = time.time() + 5
+    while True:
+        try:
+            ring = SharedRingReader(path)
+            break
+        except (OSError, ValueError):
+            assert time.time() < deadline
+            time.sleep(0.01)
+    seen = []
+    while writer.is_alive() or not seen:
+        rows = ring.read()
+        assert rows.shape[1:] == (len(fields),)
+        assert (rows == rows[:, :1]).all()
+        seen.extend(rows[:, ring.index["f0"]].tolist())
+    writer.join()
+    assert seen == sorted(seen)
+    assert seen[-1] == 19999
@@ -0,0 +1,114 @@
+import base64
+import json
+import os
+import socket
+import struct
+import time
+
+import pytest
+
+from macpm.stream import StreamServer, websocket_frame
+
+
+@pytest.fixture
+def server():
+    server = StreamServer("127.0.0.1", 0).start()
+    yield server
+    server.stop()
+
+
+def connect(server, path, headers=()):
+    sock = socket.create_connection(("127.0.0.1", server.port), timeout=5)
+    lines = [f"GET {path} HTTP/1.1", "Host: localhost", *headers]
+    sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode())
+    return sock
+
+
+def read_until(sock, marker, data=b""):
+    while marker not in data:
+        chunk = sock.recv(65536)
+        assert chunk, data
+        data += chunk
+    return data
+
+
+def publish_when_subscribed(server, samples):
+    deadline = time.time() + 5
+    while not server.clients:
+        assert time.time() < deadline
+        time.sleep(0.01)
+    for sample in samples:
+        server.publish(sample)
+
+
+samples = [
+    {"cpu_W": 1.0, "cpu_freq": 600.0, "gpu_W": 0.5},
+    {"cpu_W": 1.0, "cpu_freq": 900.0, "gpu_W": 0.7},
+    {"cpu_W": 2.0, "cpu_freq": 900.0, "gpu_W": 0.9},
+]
+# the cpu_* subscription: one full message, then only what changed
+expected = [
+    {"seq": 1, "full": True, "values": {"cpu_W": 1.0, "cpu_freq": 600.0}},
+    {"seq": 2, "values": {"cpu_freq": 900.0}},
+    {"seq": 3, "values": {"cpu_W": 2.0}},
+]
+
+
+def test_sse_field_subset(server):
+    sock = connect(server, "/stream?fields=cpu_*")
+    head = read_until(sock, b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.1 200 OK")
+    assert b"Access-Control-Allow-Origin" not in head
+    publish_when_subscribed(server, samples)
+    data = head.split(b"\r\n\r\n", 1)[1]
+    while data.count(b"\n\n") < len(expected):
+        data += sock.recv(65536)
+    events = [event for event in data.decode().split("\n\n") if event]
+    messages = [json.loads(event.split("data: ", 1)[1]) for event in events]
+    assert messages == expected
+    sock.close()
+
+
+def read_frame(sock, data):
+    while len(data) < 2 or len(data) < 2 + (data[1] & 0x7F):
+        data += sock.recv(65536)
+    length = data[1] & 0x7F
+    assert length < 126
+    return data[2:2 + length], data[2 + length:]
+
+
+def test_websocket_field_subset(server):
+    key = base64.b64encode(os.urandom(16)).decode()
+    sock = connect(server, "/ws?fields=cpu_W,cpu_freq",
+                   ["Upgrade: websocket", "Connection: Upgrade", f"Sec-WebSocket-Key: {key}",
+                    "Sec-WebSocket-Version: 13", "Origin: http://localhost:3000"])
+    data = read_until(sock, b"\r\n\r\n")
+    head, data = data.split(b"\r\n\r\n", 1)
+    assert head.startswith(b"HTTP/1.1 101")
+    publish_when_subscribed(server, samples)
+    messages = []
+    for _ in expected:
+        payload, data = read_frame(sock, data)
+        messages.append(json.loads(payload))
+    assert messages == expected
+    # a masked close frame from the client ends the stream cleanly
+    sock.sendall(struct.pack(">BB", 0x88, 0x80) + b"\0\0\0\0")
+    payload, data = read_frame(sock, data)
+    assert payload == b""
+    sock.close()
+
+
+@pytest.mark.parametrize("path", ["/stream", "/ws", "/fields"])
+def test_foreign_origin_rejected(server, path):
+    sock = connect(server, path, ["Upgrade: websocket", "Connection: Upgrade",
+                                  "Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==",
+                                  "Origin: http://evil.example"])
+    assert read_until(sock, b"\r\n\r\n").startswith(b"HTTP/1.1 403")
+    assert not server.clients
+    sock.close()
+
+
+def test_websocket_frame_lengths():
+    assert websocket_frame(b"x" * 125)[:2] == b"\x81\x7d"
+    assert websocket_frame(b"x" * 126)[:4] == b"\x81\x7e\x00\x7e"
+    assert websocket_frame(b"x" * 70000)[:2] == b"\x81\x7f"